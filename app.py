@@ -1,14 +1,28 @@
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
-import cv2
-import numpy as np
-from pyzbar.pyzbar import decode
 import gspread
 from google.oauth2.service_account import Credentials
+from streamlit_webrtc import webrtc_streamer
 import datetime
+import functools
 import hashlib
+import os
 import time
+from metrics import METRICS
+from scanner import SCAN_STATS, SYMBOLOGY_ORDER, DecodePool, LiveScanner, ScannerBusy, scan_image_bytes
+from backends import SheetsBackend
+from fake_sheets import FakeSpreadsheet
+from sheets import LOG, WRITE, RateLimitedClient, RateLimitedWorksheet, SheetsQuota
+from storage import ALREADY_TAKEN, GRANTED, UNKNOWN, DataService, row_from_range
+
+DATA_DIR = os.environ.get("CREM_DATA_DIR", "data")
+SHEETS_REQUESTS_PER_MINUTE = int(os.environ.get("CREM_SHEETS_QUOTA", "60"))
+# "fake" runs the app on an in-memory spreadsheet, without a Google account
+SHEETS_BACKEND = os.environ.get("CREM_SHEETS_BACKEND", "google")
+# Worker processes decoding the photos; unset uses all cores but one, 0 decodes in the session thread
+DECODE_PROCESSES = os.environ.get("CREM_DECODE_PROCESSES")
+LOG_HEADER = ["Date", "Heure", "Utilisateur", "Action", "Détails", "Statut"]
 
 # Performance optimizations
 @st.cache_resource
@@ -28,41 +42,285 @@ def get_gspread_client():
         "client_x509_cert_url": st.secrets["gcp_service_account"]["client_x509_cert_url"]
     }
     creds = Credentials.from_service_account_info(credentials, scopes=scopes)
-    return gspread.authorize(creds)
+    # Every call shares one quota: distribution writes first, then log appends, then reads
+    return RateLimitedClient(gspread.authorize(creds), SheetsQuota(SHEETS_REQUESTS_PER_MINUTE), lanes={"Logs": LOG})
+
+@st.cache_resource
+def get_fake_spreadsheet():
+    """In-memory spreadsheet used when CREM_SHEETS_BACKEND=fake"""
+    return FakeSpreadsheet({"Sheet1": [["Numéro d'adhérent"]]})
+
+def open_worksheets():
+    """Student and log worksheets, creating the Logs worksheet on first use"""
+    if SHEETS_BACKEND == "fake":
+        spreadsheet = get_fake_spreadsheet()
+    else:
+        spreadsheet = get_gspread_client().open("1")
+    try:
+        log_sheet = spreadsheet.worksheet("Logs")
+    except gspread.exceptions.WorksheetNotFound:
+        log_sheet = spreadsheet.add_worksheet(title="Logs", rows=1000, cols=6)
+        log_sheet.append_row(LOG_HEADER)
+    return spreadsheet.sheet1, log_sheet
+
+def sync_worksheet(sheet):
+    """The sync worker's handle: its reconcile reads are part of the distribution write, so they share its lane"""
+    return sheet.with_priority(WRITE) if isinstance(sheet, RateLimitedWorksheet) else sheet
+
+@st.cache_resource
+def get_data_service():
+    """Spreadsheet handles, snapshots and write queues, opened once for all sessions"""
+    return DataService(open_worksheets, DATA_DIR, log_columns=len(LOG_HEADER), sync_view=sync_worksheet,
+                       student_reload_interval=STUDENT_FULL_RELOAD_TTL).start()
 
 # Preload data at session start
 def preload_data():
-    """Preload all necessary data"""
+    """Attach the session to the shared data service; no API call after the first session"""
     if 'data_preloaded' not in st.session_state:
-        client = get_gspread_client()
-        sheet = client.open("1").sheet1
-        
-        try:
-            log_sheet = client.open("1").worksheet("Logs")
-        except gspread.exceptions.WorksheetNotFound:
-            log_sheet = client.open("1").add_worksheet(title="Logs", rows=1000, cols=6)
-            log_sheet.append_row(["Date", "Heure", "Utilisateur", "Action", "Détails", "Statut"])
-        
-        st.session_state.sheet = sheet
-        st.session_state.log_sheet = log_sheet
+        get_data_service()
         st.session_state.data_preloaded = True
         st.session_state.last_data_update = time.time()
 
-@st.cache_data(ttl=60)
-def get_courses():
-    """Cache course list for 1 minute"""
+def get_courses(students_index=None):
+    """Header row of the student sheet, from the shared index (pass it when already loaded)"""
+    if students_index is None:
+        students_index = load_student_index()
+    return list(students_index.header)
+
+LOG_STORE_TTL = 30
+
+def get_log_store():
+    """Indexed copy of the log sheet shared by all sessions"""
+    return get_data_service().logs
+
+def load_log_store(force_reload=False):
+    """Return the shared log store after fetching the rows added since the last read, or all of them"""
+    service = get_data_service()
+    store = service.logs
+    if service.online and (force_reload or store.is_stale(LOG_STORE_TTL)):
+        try:
+            with METRICS.span("log_store_sync"):
+                store.sync(service.log_sheet, full=force_reload)
+        except Exception as e:
+            service.report_failure(e)
+    return store
+
+STUDENT_INDEX_TTL = 30
+STUDENT_FULL_RELOAD_TTL = 1800
+
+def get_student_index():
+    """Student index shared by all sessions, updated in place after each write"""
+    return get_data_service().students
+
+def load_student_index(force_reload=False):
+    """
+    Return the shared index. Local writes are applied to it directly; rows and courses
+    appended by other writers are pulled as a delta, and the sheet is only fully
+    re-downloaded here on first use, on request or on drift. The data service reloads
+    it in the background every STUDENT_FULL_RELOAD_TTL seconds for in-place edits.
+    While Google Sheets is unreachable the last snapshot on disk is served.
+    """
+    service = get_data_service()
+    index = service.students
+    if not service.online:
+        if not index.loaded_at and index.load_snapshot(service.snapshot_path):
+            service.restore_local_writes(index)
+        METRICS.count("student_index", result="hors ligne")
+        return index
+
+    try:
+        reload = force_reload or not index.loaded_at
+        if not reload and index.needs_refresh(STUDENT_INDEX_TTL):
+            METRICS.count("student_index", result="delta")
+            with METRICS.span("student_index_refresh"):
+                reload = not index.refresh(service.sheet)
+            if not reload:
+                index.save_snapshot(service.snapshot_path)
+        elif not reload:
+            METRICS.count("student_index", result="hit")
+        if reload:
+            METRICS.count("student_index", result="rechargement")
+            with METRICS.span("student_index_reload"):
+                service.reload_students()
+    except Exception as e:
+        service.report_failure(e)
+        if not index.loaded_at and index.load_snapshot(service.snapshot_path):
+            service.restore_local_writes(index)
+    return index
+
+@st.cache_resource
+def get_backend():
+    """Storage backend of the distribution flow: Google Sheets through the shared data service"""
+    return SheetsBackend(get_data_service())
+
+@st.cache_resource
+def get_decode_pool():
+    """Worker processes shared by all sessions for photo decoding, None to decode in the script thread"""
+    if DECODE_PROCESSES == "0":
+        return None
+    return DecodePool(int(DECODE_PROCESSES)) if DECODE_PROCESSES else DecodePool()
+
+def scan_photo(buffer, night_mode):
+    """Decode a camera or upload photo; None, with a warning, when the decode pool is overloaded"""
+    scan_report = {}
     try:
-        return st.session_state.sheet.row_values(1)
-    except:
-        return []
+        # Without a decode pool, night mode misses try the variants concurrently in this process
+        pool = get_decode_pool()
+        decoded_objs, processed_img = scan_image_bytes(buffer.getbuffer(), night_mode, report=scan_report,
+                                                       parallel=night_mode and pool is None, pool=pool)
+    except ScannerBusy:
+        st.warning("⏳ Beaucoup de scans en cours, reprenez la photo dans quelques secondes.")
+        return None
+    METRICS.observe("scan_by_tutor", scan_report["elapsed_ms"], user=st.session_state.username)
+    return decoded_objs, processed_img, scan_report
+
+UNKNOWN_MESSAGE = "⚠️ Numéro d'adhérent ou cours introuvable dans la feuille."
+
+def record_distribution(numero_adherent, cours):
+    """
+    Record a distribution in the local ledger and queue its sync to the sheet.
+    Returns GRANTED, ALREADY_TAKEN, or UNKNOWN when the student or the course is not in the sheet.
+    """
+    with METRICS.span("attribution", user=st.session_state.username):
+        return get_backend().grant(numero_adherent, cours, username=st.session_state.username)
 
 @st.cache_data(ttl=300)
-def get_all_students_data():
-    """Cache student data for 5 minutes"""
+def get_printed_counts():
+    """Printed polys per course, from the optional "Stock" worksheet"""
+    try:
+        values = get_data_service().spreadsheet.worksheet("Stock").get_all_values()
+    except gspread.exceptions.WorksheetNotFound:
+        return {}
+    counts = {}
+    for row in values[1:]:
+        if len(row) >= 2 and row[0]:
+            try:
+                counts[row[0]] = int(float(row[1]))
+            except ValueError:
+                pass
+    return counts
+
+def save_printed_counts(printed_counts):
+    """Write the whole "Stock" worksheet in a single update call"""
+    spreadsheet = get_data_service().spreadsheet
     try:
-        return st.session_state.sheet.get_all_records()
-    except:
-        return []
+        stock_sheet = spreadsheet.worksheet("Stock")
+    except gspread.exceptions.WorksheetNotFound:
+        stock_sheet = spreadsheet.add_worksheet(title="Stock", rows=100, cols=2)
+    values = [["Cours", "Imprimés"]] + [[course, '' if count is None else count]
+                                        for course, count in printed_counts.items()]
+    stock_sheet.update(range_name="A1", values=values)
+    get_printed_counts.clear()
+
+def distribution_counts(students_index):
+    """Polys distributed per course, summed from the index's distribution matrix"""
+    return pd.Series(students_index.course_totals(), dtype="int64")
+
+@st.cache_data(max_entries=8)
+def course_statistics(students_version, _students_index, printed_counts):
+    """Distributed, printed and remaining polys per course, cached per index version"""
+    distributed = distribution_counts(_students_index)
+    stats = pd.DataFrame({"Cours": distributed.index, "Polys distribués": distributed.values})
+    stats["Imprimés"] = stats["Cours"].map(printed_counts).astype("Int64")
+    stats["Restants"] = stats["Imprimés"] - stats["Polys distribués"]
+    return stats
+
+@st.cache_data(max_entries=8)
+def build_dashboard(students_version, logs_version, _students_index, _log_store):
+    """
+    Dashboard aggregates computed with pandas on snapshots of the student index
+    and the log sheet; cached per snapshot version so reruns cost nothing.
+    """
+    course_counts = distribution_counts(_students_index)
+
+    logs_values = _log_store.values()
+    if logs_values:
+        logs = pd.DataFrame(logs_values[1:], columns=logs_values[0])
+    else:
+        logs = pd.DataFrame(columns=LOG_HEADER)
+    logs["Horodatage"] = pd.to_datetime(logs["Date"] + " " + logs["Heure"], format="%d/%m/%Y %H:%M:%S",
+                                        errors="coerce")
+    per_day = logs.groupby(logs["Horodatage"].dt.date).size()
+
+    return {
+        "total_students": len(_students_index),
+        "total_polys": int(course_counts.sum()),
+        "course_counts": course_counts.rename("Polys distribués"),
+        "status_counts": logs["Statut"].value_counts(),
+        "per_day": per_day.rename_axis("Date").rename("Activités"),
+        "per_user": logs.groupby("Utilisateur").size().sort_values(ascending=False).rename("Activités"),
+        "recent": logs.sort_values("Horodatage", ascending=False).head(10).drop(columns="Horodatage"),
+    }
+
+def parse_numeros(text):
+    """CREM numbers from a pasted list or a CSV (first column), in order"""
+    numeros = []
+    for line in text.splitlines():
+        field = line.replace(";", ",").replace("\t", ",").split(",")[0].strip().strip('"')
+        numeros.extend(field.split())
+    return numeros
+
+def record_bulk_distribution(numeros, cours):
+    """Record many distributions of one course at once; returns (numero, status) pairs"""
+    return get_backend().grant_many(numeros, cours, username=st.session_state.username)
+
+def timed_fragment(name):
+    """st.fragment whose runs, with the page or on their own, are timed into the "fragment_run" histogram"""
+    def decorate(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            with METRICS.span("fragment_run", fragment=name):
+                return func(*args, **kwargs)
+        return st.fragment(run)
+    return decorate
+
+@timed_fragment("bulk")
+def render_bulk_distribution(cours, liste_cours, students_index, key):
+    """Bulk mode: pasted list, CSV or queued scans, for a single course; reruns on its own"""
+    st.write(f"Cours : **{cours}**")
+    texte = st.text_area("Numéros d'adhérent (un par ligne)", key=f"bulk_text_{key}")
+    fichier = st.file_uploader("Ou importer un CSV (numéros en première colonne)", type=['csv', 'txt'],
+                               key=f"bulk_csv_{key}")
+    queued_scans = st.session_state.setdefault("scan_queue", [])
+    if queued_scans:
+        st.info(f"📋 {len(queued_scans)} scan(s) en file d'attente : {', '.join(queued_scans)}")
+
+    if st.button("Attribuer à tous", key=f"bulk_submit_{key}"):
+        numeros = parse_numeros(texte)
+        if fichier:
+            numeros += [n for n in parse_numeros(fichier.getvalue().decode("utf-8-sig"))
+                        if n != students_index.id_field]
+        taken_from_queue = list(queued_scans)
+        numeros += taken_from_queue
+        if not numeros:
+            st.warning("⚠️ Aucun numéro d'adhérent à traiter.")
+        elif cours not in liste_cours:
+            st.error("⚠️ Le cours sélectionné n'existe pas dans la feuille.")
+        else:
+            try:
+                report = record_bulk_distribution(numeros, cours)
+            except Exception as e:
+                st.error(f"❌ Erreur lors de la mise à jour : {e}")
+                batch_log_activity(st.session_state.username, "Attribution groupée",
+                                   f"Cours: {cours}, Erreur: {str(e)}", "Échec")
+            else:
+                # Trimmed in place: the live scanner's handler may still be appending to this list
+                del queued_scans[:len(taken_from_queue)]
+                labels = {GRANTED: "Attribué", ALREADY_TAKEN: "Déjà récupéré"}
+                for numero, status in report:
+                    if status == GRANTED:
+                        batch_log_activity(st.session_state.username, "Attribution groupée",
+                                           f"ID: {numero}, Cours: {cours}", "Succès")
+                    else:
+                        batch_log_activity(st.session_state.username, "Attribution groupée",
+                                           f"ID: {numero}, Cours: {cours}, {labels.get(status, 'Non trouvé')}",
+                                           "Échec")
+                granted = sum(1 for _, status in report if status == GRANTED)
+                st.success(f"✅ {granted} poly(s) {cours} attribué(s) sur {len(report)} numéro(s).")
+                st.dataframe(pd.DataFrame([
+                    {"Numéro d'adhérent": numero, "Résultat": labels.get(status, "Non trouvé")}
+                    for numero, status in report
+                ]), use_container_width=True)
 
 # Session persistence
 def generate_session_token(username, password):
@@ -90,41 +348,281 @@ def check_persistent_session():
                 return True
     return False
 
-def find_student_row(numero_adherent, students_data):
-    """Find student row locally instead of using sheet.find()"""
-    if not students_data:
+def find_student_row(numero_adherent, students_index):
+    """Find student row with an O(1) lookup in the shared index"""
+    if students_index is None:
         return None
-    
-    id_field = list(students_data[0].keys())[0] if students_data else None
-    for i, student in enumerate(students_data):
-        if str(student.get(id_field, '')).strip() == str(numero_adherent).strip():
-            return i + 2  # +2 because get_all_records ignores header row
-    return None
+    return students_index.find_row(numero_adherent)
 
-def batch_log_activity(username, action, details, status):
-    """Add log to batch queue instead of immediate upload"""
-    if 'pending_logs' not in st.session_state:
-        st.session_state.pending_logs = []
-    
+def get_log_shipper():
+    """Process-wide log buffer shared by all sessions"""
+    return get_data_service().log_shipper
+
+def make_log_row(username, action, details, status):
+    """Log sheet row stamped with the current date and time"""
     now = datetime.datetime.now()
     date_str = now.strftime("%d/%m/%Y")
     time_str = now.strftime("%H:%M:%S")
+    return [date_str, time_str, username, action, details, status]
+
+def batch_log_activity(username, action, details, status):
+    """Add log to the shared batch queue instead of immediate upload"""
+    # Shipped in one append_rows call by size or time threshold
+    get_backend().append_logs([make_log_row(username, action, details, status)])
+
+def flush_pending_logs():
+    """Ask the shipper to send all pending logs to sheet"""
+    get_log_shipper().notify()
+
+def make_live_code_handler(cours, liste_cours, username, scan_queue=None):
+    """
+    Distribution callback for the live scanner. It runs on the video thread,
+    so every shared handle is resolved here and no st.* call happens inside.
+    With a scan_queue list, codes are queued for the bulk tab instead of attributed.
+    """
+    load_student_index()
+    backend = get_backend()
+
+    def on_code(barcode_data):
+        if scan_queue is not None:
+            if barcode_data not in scan_queue:
+                scan_queue.append(barcode_data)
+            return f"📋 {barcode_data} en file d'attente ({len(scan_queue)} au total)"
+        if not backend.find_student(barcode_data):
+            backend.append_logs([make_log_row(username, "Enregistrement poly continu",
+                                              f"ID: {barcode_data} non trouvé", "Échec")])
+            return f"❌ {barcode_data} : numéro d'adhérent non trouvé dans la base de données."
+        if cours not in liste_cours:
+            return "⚠️ Le cours sélectionné n'existe pas dans la feuille."
+        status = backend.grant(barcode_data, cours, username=username)
+        if status == UNKNOWN:
+            backend.append_logs([make_log_row(username, "Enregistrement poly continu",
+                                              f"ID: {barcode_data}, Cours: {cours} introuvable", "Échec")])
+            return UNKNOWN_MESSAGE
+        if status == ALREADY_TAKEN:
+            backend.append_logs([make_log_row(username, "Enregistrement poly continu",
+                                              f"ID: {barcode_data}, Cours: {cours}, Déjà récupéré", "Échec")])
+            return f"❌ {barcode_data} a déjà récupéré le poly {cours}."
+        backend.append_logs([make_log_row(username, "Enregistrement poly continu",
+                                          f"ID: {barcode_data}, Cours: {cours}", "Succès")])
+        return f"✅ Poly {cours} attribué à l'étudiant {barcode_data} !"
+
+    return on_code
+
+def render_live_history():
+    """Collect the live scanner's new outcomes and show the latest ones"""
+    history = st.session_state.live_history
+    history[:0] = [outcome for _, outcome in reversed(st.session_state.live_scanner.drain()) if outcome]
+    del history[10:]
+    for outcome in history:
+        if outcome.startswith("✅"):
+            st.success(outcome)
+        elif outcome.startswith("📋"):
+            st.info(outcome)
+        else:
+            st.error(outcome)
+
+@st.fragment(run_every=1)
+def show_live_results():
+    """Poll the live scanner once per second; only rendered while the stream is playing"""
+    render_live_history()
+
+def attribute_scanned_code(barcode_data, cours, liste_cours, students_index):
+    """Hand out the selected course to a scanned student; returns the (level, message) lines to show"""
+    # Fast local search instead of sheet.find()
+    if not find_student_row(barcode_data, students_index):
+        batch_log_activity(st.session_state.username, "Enregistrement poly",
+                           f"ID: {barcode_data} non trouvé", "Échec")
+        return [("error", "❌ Numéro d'adhérent non trouvé dans la base de données.")]
+    if cours not in liste_cours:
+        batch_log_activity(st.session_state.username, "Enregistrement poly",
+                           f"ID: {barcode_data}, Cours: {cours} inexistant", "Échec")
+        return [("error", "⚠️ Le cours sélectionné n'existe pas dans la feuille.")]
+    try:
+        status = record_distribution(barcode_data, cours)
+        if status == UNKNOWN:
+            batch_log_activity(st.session_state.username, "Enregistrement poly",
+                               f"ID: {barcode_data}, Cours: {cours} introuvable", "Échec")
+            return [("error", UNKNOWN_MESSAGE)]
+        if status == ALREADY_TAKEN:
+            batch_log_activity(st.session_state.username, "Enregistrement poly",
+                               f"ID: {barcode_data}, Cours: {cours}, Déjà récupéré", "Échec")
+            return [("error", f"❌ Cet étudiant a déjà récupéré le poly {cours}.")]
+        batch_log_activity(st.session_state.username, "Enregistrement poly",
+                           f"ID: {barcode_data}, Cours: {cours}", "Succès")
+        return [("success", f"✅ Poly {cours} attribué à l'étudiant {barcode_data} !")]
+    except Exception as e:
+        batch_log_activity(st.session_state.username, "Enregistrement poly",
+                           f"ID: {barcode_data}, Cours: {cours}, Erreur: {str(e)}", "Échec")
+        return [("error", f"❌ Erreur lors de la mise à jour : {e}")]
+
+def render_photo_scan(buffer, source, cours, liste_cours, night_mode, queue_mode):
+    """
+    Decode a camera or upload photo, then queue the code or hand out the poly. Each photo
+    is handled once: later reruns still carrying it replay the outcome instead of
+    attributing again.
+    """
+    handled = st.session_state.setdefault("handled_photos", {})
+    if handled.get(source, (None,))[0] == buffer.file_id:
+        messages = handled[source][1]
+    else:
+        scan = scan_photo(buffer, night_mode)
+        if scan is None:
+            return
+        decoded_objs, processed_img, scan_report = scan
+
+        if decoded_objs and queue_mode:
+            barcode_data = decoded_objs[0].data.decode("utf-8")
+            if barcode_data not in st.session_state.scan_queue:
+                st.session_state.scan_queue.append(barcode_data)
+            messages = [("info", f"📋 {barcode_data} en file d'attente ({len(st.session_state.scan_queue)} au total)")]
+        elif decoded_objs:
+            barcode_data = decoded_objs[0].data.decode("utf-8")
+            st.session_state.numero_adherent = barcode_data
+            messages = [
+                ("success", f"✅ Code détecté: {barcode_data}"),
+                ("caption", f"Décodé à l'étape « {scan_report['stage']} » en {scan_report['elapsed_ms']:.0f} ms"
+                            + (" (déjà décodé, résultat en cache)" if scan_report["cache"] else "")),
+            ]
+            messages += attribute_scanned_code(barcode_data, cours, liste_cours, load_student_index())
+        else:
+            messages = [("error", "❌ Code-barres non reconnu. Veuillez réessayer.")]
+            if processed_img is not None:
+                messages.append(("image", processed_img))
+            if source == "camera" and not night_mode:
+                messages.append(("warning", "💡 Essayez d'activer le mode faible luminosité si vous êtes dans un "
+                                            "environnement sombre."))
+        handled[source] = (buffer.file_id, messages)
+
+    for level, message in messages:
+        if level == "image":
+            st.image(message, caption="Dernière image traitée", channels="GRAY", width=300)
+        else:
+            getattr(st, level)(message)
+
+@timed_fragment("camera")
+def camera_scan(cours, liste_cours, night_mode, queue_mode):
+    """Camera tab; taking a photo reruns only this fragment"""
+    st.write("Préparez-vous à scanner le code-barres de l'étudiant")
+    img_file_buffer = st.camera_input("Prendre la photo et enregistrer", key="camera_input")
+    if img_file_buffer:
+        # Process image immediately when camera input is received
+        render_photo_scan(img_file_buffer, "camera", cours, liste_cours, night_mode, queue_mode)
+
+@timed_fragment("upload")
+def upload_scan(cours, liste_cours, night_mode, queue_mode):
+    """Upload tab; importing a photo reruns only this fragment"""
+    uploaded_file = st.file_uploader("Importer une photo contenant un code-barres",
+                                     type=['jpg', 'jpeg', 'png', 'bmp'])
+    if uploaded_file:
+        render_photo_scan(uploaded_file, "upload", cours, liste_cours, night_mode, queue_mode)
+
+@timed_fragment("manual")
+def manual_attribution(liste_cours):
+    """Manual entry tab; its buttons rerun only this fragment"""
+    st.write("Saisie manuelle du numéro d'adhérent")
+    numero_adherent_manuel = st.text_input("Numéro d'adhérent", key="manual_input_user")
+    
+    students_index = load_student_index()
+    if st.button("Vérifier et attribuer", key="verify_manual_user"):
+        if numero_adherent_manuel:
+            student_row = find_student_row(numero_adherent_manuel, students_index)
+            
+            if student_row:
+                st.success(f"✅ Numéro d'adhérent {numero_adherent_manuel} trouvé")
+                
+                # Barre de saisie pour le cours
+                cours_manuel = st.text_input("Nom du cours à distribuer", key="course_manual_user")
+                
+                if st.button("Confirmer l'attribution", key="confirm_manual_user"):
+                    if cours_manuel and cours_manuel in liste_cours:
+                        try:
+                            status = record_distribution(numero_adherent_manuel, cours_manuel)
+                            if status == UNKNOWN:
+                                st.error(UNKNOWN_MESSAGE)
+                                batch_log_activity(st.session_state.username, "Enregistrement poly manuel",
+                                             f"ID: {numero_adherent_manuel}, Cours: {cours_manuel} introuvable",
+                                             "Échec")
+                            elif status == ALREADY_TAKEN:
+                                st.error(f"❌ Cet étudiant a déjà récupéré le poly {cours_manuel}.")
+                                batch_log_activity(st.session_state.username, "Enregistrement poly manuel",
+                                             f"ID: {numero_adherent_manuel}, Cours: {cours_manuel}, Déjà récupéré",
+                                             "Échec")
+                            else:
+                                st.success(f"✅ Poly {cours_manuel} attribué à l'étudiant {numero_adherent_manuel} !")
+                                batch_log_activity(st.session_state.username, "Enregistrement poly manuel",
+                                             f"ID: {numero_adherent_manuel}, Cours: {cours_manuel}",
+                                             "Succès")
+                        except Exception as e:
+                            st.error(f"❌ Erreur lors de la mise à jour : {e}")
+                            batch_log_activity(st.session_state.username, "Enregistrement poly manuel",
+                                         f"ID: {numero_adherent_manuel}, Cours: {cours_manuel}, Erreur: {str(e)}",
+                                         "Échec")
+                    elif cours_manuel:
+                        st.error("⚠️ Le cours saisi n'existe pas. Vérifiez l'orthographe.")
+                    else:
+                        st.warning("⚠️ Veuillez saisir le nom du cours.")
+            else:
+                st.error("❌ Numéro d'adhérent non trouvé dans la base de données.")
+                batch_log_activity(st.session_state.username, "Vérification manuel",
+                             f"ID: {numero_adherent_manuel} non trouvé", "Échec")
+        else:
+            st.warning("⚠️ Veuillez saisir un numéro d'adhérent.")
+
+@timed_fragment("simple")
+def simple_attribution(liste_cours):
+    """Quick attribution form of the admins' tutor tab; Enter and the button rerun only this fragment"""
+    # Première barre de saisie
+    numero_adherent_simple = st.text_input("Numéro d'adhérent", key="adherent_simple", placeholder="Tapez le numéro et appuyez sur Entrée")
     
-    st.session_state.pending_logs.append([date_str, time_str, username, action, details, status])
+    # Deuxième barre de saisie
+    cours_simple = st.text_input("Nom du cours", key="cours_simple", placeholder="Nom exact du cours")
     
-    # Send batch when we have 5+ logs
-    if len(st.session_state.pending_logs) >= 5:
-        flush_pending_logs()
+    students_index = load_student_index()
 
-def flush_pending_logs():
-    """Send all pending logs to sheet"""
-    if 'pending_logs' in st.session_state and st.session_state.pending_logs:
-        try:
-            for log_entry in st.session_state.pending_logs:
-                st.session_state.log_sheet.append_row(log_entry)
-            st.session_state.pending_logs = []
-        except Exception as e:
-            pass  # Silent fail for logging
+    # Bouton de validation
+    if st.button("Attribuer le poly", key="attribuer_simple"):
+        if numero_adherent_simple and cours_simple:
+            # Fast local search instead of sheet.find()
+            student_row = find_student_row(numero_adherent_simple, students_index)
+            
+            if student_row:
+                # Vérifier si le cours existe
+                if cours_simple in liste_cours:
+                    try:
+                        status = record_distribution(numero_adherent_simple, cours_simple)
+                        if status == UNKNOWN:
+                            st.error(UNKNOWN_MESSAGE)
+                            batch_log_activity(st.session_state.username, "Attribution poly simple",
+                                         f"ID: {numero_adherent_simple}, Cours: {cours_simple} introuvable",
+                                         "Échec")
+                        elif status == ALREADY_TAKEN:
+                            st.error(f"❌ L'étudiant {numero_adherent_simple} a déjà récupéré le poly {cours_simple}.")
+                            batch_log_activity(st.session_state.username, "Attribution poly simple",
+                                         f"ID: {numero_adherent_simple}, Cours: {cours_simple}, Déjà récupéré",
+                                         "Échec")
+                        else:
+                            st.success(f"✅ Poly {cours_simple} attribué à l'étudiant {numero_adherent_simple} !")
+                            batch_log_activity(st.session_state.username, "Attribution poly simple",
+                                         f"ID: {numero_adherent_simple}, Cours: {cours_simple}",
+                                         "Succès")
+                    except Exception as e:
+                        st.error(f"❌ Erreur lors de la mise à jour : {e}")
+                        batch_log_activity(st.session_state.username, "Attribution poly simple",
+                                     f"ID: {numero_adherent_simple}, Cours: {cours_simple}, Erreur: {str(e)}",
+                                     "Échec")
+                else:
+                    st.error(f"⚠️ Le cours '{cours_simple}' n'existe pas dans la base.")
+                    if len(liste_cours) > 1:
+                        st.info("Cours disponibles : " + ", ".join(liste_cours[1:]))
+            else:
+                st.error(f"❌ Numéro d'adhérent {numero_adherent_simple} non trouvé.")
+                batch_log_activity(st.session_state.username, "Vérification simple",
+                             f"ID: {numero_adherent_simple} non trouvé", "Échec")
+        elif not numero_adherent_simple:
+            st.warning("⚠️ Veuillez saisir un numéro d'adhérent.")
+        else:
+            st.warning("⚠️ Veuillez saisir le nom du cours.")
 
 # pompompidou
 
@@ -133,6 +631,9 @@ st.set_page_config(
     page_icon="logo.png"
 )
 
+# Full script runs are timed at the bottom of the page; fragments time themselves
+run_started = time.perf_counter()
+
 # Initialize performance optimizations
 preload_data()
 
@@ -146,74 +647,6 @@ def verifier_identifiants(utilisateur, mot_de_passe):
     return utilisateurs.get(utilisateur) == mot_de_passe
 
 
-def enhance_for_low_light(image, alpha=1.5, beta=10):
-    enhanced = cv2.convertScaleAbs(image, alpha=alpha, beta=beta)
-    return enhanced
-
-
-def scan_barcode(image, night_mode=False):
-    """
-    Enhanced barcode scanning with improved preprocessing.
-    """
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # Enhanced preprocessing for different lighting conditions
-    if night_mode:
-        # Apply CLAHE for better contrast in low light
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        gray = clahe.apply(gray)
-
-        # Enhanced brightness/contrast for night mode
-        gray = cv2.convertScaleAbs(gray, alpha=2.0, beta=30)
-
-    # Apply noise reduction (reduces camera noise impact)
-    denoised = cv2.fastNlMeansDenoising(gray, None, h=10, templateWindowSize=7, searchWindowSize=21)
-
-    # Apply Gaussian blur
-    blurred = cv2.GaussianBlur(denoised, (5, 5), 0)
-
-    # Try decoding the preprocessed image
-    results = decode(blurred)
-    if results:
-        return results, blurred
-
-    # Try with adaptive thresholding
-    block_size = 15 if night_mode else 11
-    c_value = 7 if night_mode else 2
-
-    thresh = cv2.adaptiveThreshold(
-        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY, block_size, c_value
-    )
-
-    results = decode(thresh)
-    if results:
-        return results, thresh
-
-    # Try inverted threshold (often helps with certain barcodes)
-    thresh_inv = cv2.bitwise_not(thresh)
-    results = decode(thresh_inv)
-    if results:
-        return results, thresh_inv
-
-    # Try edge detection
-    edges = cv2.Canny(blurred, 30 if night_mode else 50, 150 if night_mode else 200)
-    results = decode(edges)
-    if results:
-        return results, edges
-
-    # Try morphological operations as last resort
-    kernel = np.ones((5, 5) if night_mode else (3, 3), np.uint8)
-    closing = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-    results = decode(closing)
-    if results:
-        return results, closing
-
-    # If all methods fail
-    return None, blurred
-
-
 if "authentifie" not in st.session_state:
     st.session_state.authentifie = False
     st.session_state.username = None
@@ -254,6 +687,12 @@ if not st.session_state.authentifie:
 
     st.stop()
 
+service = get_data_service()
+if not service.online:
+    st.warning(f"⚠️ Mode hors ligne: Google Sheets est injoignable. Les distributions sont enregistrées sur ce "
+               f"serveur ({service.ledger.counts().get('pending', 0)} en attente) et seront synchronisées au retour de la "
+               f"connexion.")
+
 # For the non-admin user interface
 if st.session_state.username not in st.session_state.is_admin:
     st.header(f"Coucou {st.session_state.username} !")
@@ -261,13 +700,15 @@ if st.session_state.username not in st.session_state.is_admin:
     # 1. COURSE SELECTION - MOVED TO FIRST POSITION
     st.subheader("1. Sélectionner un cours")
 
-    # Optimized course loading
-    liste_cours = get_courses()
+    # One index load per page run; the scan and attribution fragments below rerun without it
+    students_index = load_student_index()
+    liste_cours = get_courses(students_index)
     if not liste_cours:
         st.error("⚠️ Aucun cours trouvé dans la première ligne du Google Sheets.")
         log_activity(st.session_state.username, "Chargement des cours", "Aucun cours trouvé", "Échec")
 
-    cours_selectionne = st.selectbox("Choisissez un cours :", liste_cours)
+    # The first header cell is the id column, not a course
+    cours_selectionne = st.selectbox("Choisissez un cours :", liste_cours[1:])
 
     # Store the selected course in session state
     if "cours_selectionne" not in st.session_state:
@@ -283,187 +724,61 @@ if st.session_state.username not in st.session_state.is_admin:
 
     night_mode = st.checkbox("Mode faible luminosité",
                              help="Activez cette option si vous êtes dans un environnement peu éclairé")
+    queue_mode = st.checkbox("Mettre les scans en file d'attente",
+                             help="Les codes scannés sont attribués tous ensemble depuis l'onglet « Distribution groupée »")
+    st.session_state.setdefault("scan_queue", [])
 
-    scan_tab, upload_tab, manual_tab = st.tabs(["Utiliser la caméra", "Importer une image", "Saisie manuelle"])
-
-    # Get cached student data
-    students_data = get_all_students_data()
+    scan_tab, live_tab, upload_tab, manual_tab, bulk_tab = st.tabs(["Utiliser la caméra", "Scan en continu",
+                                                                    "Importer une image", "Saisie manuelle",
+                                                                    "Distribution groupée"])
 
     # Camera scanning with immediate processing
     with scan_tab:
-        st.write("Préparez-vous à scanner le code-barres de l'étudiant")
-        img_file_buffer = st.camera_input("Prendre la photo et enregistrer", key="camera_input")
-
-        if img_file_buffer:
-            # Process image immediately when camera input is received
-            file_bytes = np.asarray(bytearray(img_file_buffer.read()), dtype=np.uint8)
-            image = cv2.imdecode(file_bytes, 1)
-            decoded_objs, processed_img = scan_barcode(image, night_mode)
-
-            if decoded_objs:
-                barcode_data = decoded_objs[0].data.decode("utf-8")
-                st.session_state.numero_adherent = barcode_data
-
-                # Display success message with extracted information
-                st.success(f"✅ Code détecté: {barcode_data}")
-
-                # Fast local search instead of sheet.find()
-                student_row = find_student_row(barcode_data, students_data)
-
-                if student_row:
-                    if cours_selectionne in liste_cours:
-                        colonne = liste_cours.index(cours_selectionne) + 1
-                        try:
-                            current_value = st.session_state.sheet.cell(student_row, colonne).value
-
-                            if current_value and str(current_value).strip() and int(float(current_value)) >= 1:
-                                st.error(f"❌ Cet étudiant a déjà récupéré le poly {cours_selectionne}.")
-                                batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                             f"ID: {barcode_data}, Cours: {cours_selectionne}, Déjà récupéré",
-                                             "Échec")
-                            else:
-                                st.session_state.sheet.update_cell(student_row, colonne, 1)
-                                st.success(f"✅ Poly {cours_selectionne} attribué à l'étudiant {barcode_data} !")
-                                batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                             f"ID: {barcode_data}, Cours: {cours_selectionne}",
-                                             "Succès")
-                                get_all_students_data.clear()
-                        except Exception as e:
-                            st.error(f"❌ Erreur lors de la mise à jour : {e}")
-                            batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                         f"ID: {barcode_data}, Cours: {cours_selectionne}, Erreur: {str(e)}",
-                                         "Échec")
-                    else:
-                        st.error("⚠️ Le cours sélectionné n'existe pas dans la feuille.")
-                        batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                     f"ID: {barcode_data}, Cours: {cours_selectionne} inexistant",
-                                     "Échec")
-                else:
-                    st.error("❌ Numéro d'adhérent non trouvé dans la base de données.")
-                    batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                 f"ID: {barcode_data} non trouvé", "Échec")
-            else:
-                st.error("❌ Code-barres non reconnu. Veuillez réessayer.")
-                st.image(processed_img, caption="Dernière image traitée", channels="GRAY", width=300)
-
-                if not night_mode:
-                    st.warning(
-                        "💡 Essayez d'activer le mode faible luminosité si vous êtes dans un environnement sombre.")
+        camera_scan(cours_selectionne, liste_cours, night_mode, queue_mode)
+
+    # Live video scanning, no button press per card
+    with live_tab:
+        st.write("Présentez les cartes des étudiants les unes après les autres devant la caméra")
+        if "live_scanner" not in st.session_state:
+            st.session_state.live_scanner = LiveScanner()
+            st.session_state.live_history = []
+
+        live_scanner = st.session_state.live_scanner
+        live_scanner.night_mode = night_mode
+        live_scanner.on_code = make_live_code_handler(cours_selectionne, liste_cours, st.session_state.username,
+                                                      st.session_state.scan_queue if queue_mode else None)
+
+        live_ctx = webrtc_streamer(
+            key="live_scan",
+            video_frame_callback=live_scanner.video_frame_callback,
+            media_stream_constraints={"video": True, "audio": False},
+            rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
+            async_processing=True,
+        )
+        if live_ctx.state.playing:
+            show_live_results()
+        else:
+            render_live_history()
 
     # Upload image with immediate processing
     with upload_tab:
-        uploaded_file = st.file_uploader("Importer une photo contenant un code-barres",
-                                         type=['jpg', 'jpeg', 'png', 'bmp'])
-
-        if uploaded_file:
-            file_bytes = np.asarray(bytearray(uploaded_file.read()), dtype=np.uint8)
-            image = cv2.imdecode(file_bytes, 1)
-            decoded_objs, processed_img = scan_barcode(image, night_mode)
-
-            if decoded_objs:
-                barcode_data = decoded_objs[0].data.decode("utf-8")
-                st.session_state.numero_adherent = barcode_data
-                st.success(f"✅ Code détecté: {barcode_data}")
-
-                # Fast local search
-                student_row = find_student_row(barcode_data, students_data)
-
-                if student_row:
-                    if cours_selectionne in liste_cours:
-                        colonne = liste_cours.index(cours_selectionne) + 1
-                        try:
-                            current_value = st.session_state.sheet.cell(student_row, colonne).value
+        upload_scan(cours_selectionne, liste_cours, night_mode, queue_mode)
 
-                            if current_value and str(current_value).strip() and int(float(current_value)) >= 1:
-                                st.error(f"❌ Cet étudiant a déjà récupéré le poly {cours_selectionne}.")
-                                batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                             f"ID: {barcode_data}, Cours: {cours_selectionne}, Déjà récupéré",
-                                             "Échec")
-                            else:
-                                st.session_state.sheet.update_cell(student_row, colonne, 1)
-                                st.success(f"✅ Poly {cours_selectionne} attribué à l'étudiant {barcode_data} !")
-                                batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                             f"ID: {barcode_data}, Cours: {cours_selectionne}",
-                                             "Succès")
-                                get_all_students_data.clear()
-                        except Exception as e:
-                            st.error(f"❌ Erreur lors de la mise à jour : {e}")
-                            batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                         f"ID: {barcode_data}, Cours: {cours_selectionne}, Erreur: {str(e)}",
-                                         "Échec")
-                    else:
-                        st.error("⚠️ Le cours sélectionné n'existe pas dans la feuille.")
-                        batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                     f"ID: {barcode_data}, Cours: {cours_selectionne} inexistant",
-                                     "Échec")
-                else:
-                    st.error("❌ Numéro d'adhérent non trouvé dans la base de données.")
-                    batch_log_activity(st.session_state.username, "Enregistrement poly",
-                                 f"ID: {barcode_data} non trouvé", "Échec")
-            else:
-                st.error("❌ Code-barres non reconnu. Veuillez réessayer.")
-                st.image(processed_img, caption="Dernière image traitée", channels="GRAY", width=300)
+    # Many students at once for the selected course
+    with bulk_tab:
+        render_bulk_distribution(cours_selectionne, liste_cours, students_index, key="user")
 
     # Manual input tab
     with manual_tab:
-        st.write("Saisie manuelle du numéro d'adhérent")
-        numero_adherent_manuel = st.text_input("Numéro d'adhérent", key="manual_input_user")
-        
-        if st.button("Vérifier et attribuer", key="verify_manual_user"):
-            if numero_adherent_manuel:
-                student_row = find_student_row(numero_adherent_manuel, students_data)
-                
-                if student_row:
-                    st.success(f"✅ Numéro d'adhérent {numero_adherent_manuel} trouvé")
-                    
-                    # Barre de saisie pour le cours
-                    cours_manuel = st.text_input("Nom du cours à distribuer", key="course_manual_user")
-                    
-                    if st.button("Confirmer l'attribution", key="confirm_manual_user"):
-                        if cours_manuel and cours_manuel in liste_cours:
-                            colonne = liste_cours.index(cours_manuel) + 1
-                            try:
-                                current_value = st.session_state.sheet.cell(student_row, colonne).value
-                                
-                                if current_value and str(current_value).strip() and int(float(current_value)) >= 1:
-                                    st.error(f"❌ Cet étudiant a déjà récupéré le poly {cours_manuel}.")
-                                    batch_log_activity(st.session_state.username, "Enregistrement poly manuel",
-                                                 f"ID: {numero_adherent_manuel}, Cours: {cours_manuel}, Déjà récupéré",
-                                                 "Échec")
-                                else:
-                                    st.session_state.sheet.update_cell(student_row, colonne, 1)
-                                    st.success(f"✅ Poly {cours_manuel} attribué à l'étudiant {numero_adherent_manuel} !")
-                                    batch_log_activity(st.session_state.username, "Enregistrement poly manuel",
-                                                 f"ID: {numero_adherent_manuel}, Cours: {cours_manuel}",
-                                                 "Succès")
-                                    get_all_students_data.clear()
-                            except Exception as e:
-                                st.error(f"❌ Erreur lors de la mise à jour : {e}")
-                                batch_log_activity(st.session_state.username, "Enregistrement poly manuel",
-                                             f"ID: {numero_adherent_manuel}, Cours: {cours_manuel}, Erreur: {str(e)}",
-                                             "Échec")
-                        elif cours_manuel:
-                            st.error("⚠️ Le cours saisi n'existe pas. Vérifiez l'orthographe.")
-                        else:
-                            st.warning("⚠️ Veuillez saisir le nom du cours.")
-                else:
-                    st.error("❌ Numéro d'adhérent non trouvé dans la base de données.")
-                    batch_log_activity(st.session_state.username, "Vérification manuel",
-                                 f"ID: {numero_adherent_manuel} non trouvé", "Échec")
-            else:
-                st.warning("⚠️ Veuillez saisir un numéro d'adhérent.")
+        manual_attribution(liste_cours)
 
 
 if st.session_state.username in st.session_state.is_admin:
     tab1, tab2 = st.tabs(["Interface des tuteurs", "Admin"])
     with tab1:
         # Optimized data loading with cache
-        liste_cours = get_courses()
-        students_data = get_all_students_data()
-        
-        # Initialize session state for batch processing
-        if 'pending_logs' not in st.session_state:
-            st.session_state.pending_logs = []
+        students_index = load_student_index()
+        liste_cours = get_courses(students_index)
         
         # JavaScript pour raccourcis clavier optimisés
         components.html("""
@@ -506,62 +821,14 @@ if st.session_state.username in st.session_state.is_admin:
         </script>
         """, height=0)
         
-        # Première barre de saisie
-        numero_adherent_simple = st.text_input("Numéro d'adhérent", key="adherent_simple", placeholder="Tapez le numéro et appuyez sur Entrée")
-        
-        # Deuxième barre de saisie
-        cours_simple = st.text_input("Nom du cours", key="cours_simple", placeholder="Nom exact du cours")
-        
-        # Bouton de validation
-        if st.button("Attribuer le poly", key="attribuer_simple"):
-            if numero_adherent_simple and cours_simple:
-                # Fast local search instead of sheet.find()
-                student_row = find_student_row(numero_adherent_simple, students_data)
-                
-                if student_row:
-                    # Vérifier si le cours existe
-                    if cours_simple in liste_cours:
-                        colonne = liste_cours.index(cours_simple) + 1
-                        
-                        try:
-                            current_value = st.session_state.sheet.cell(student_row, colonne).value
-                            
-                            if current_value and str(current_value).strip() and int(float(current_value)) >= 1:
-                                st.error(f"❌ L'étudiant {numero_adherent_simple} a déjà récupéré le poly {cours_simple}.")
-                                batch_log_activity(st.session_state.username, "Attribution poly simple",
-                                             f"ID: {numero_adherent_simple}, Cours: {cours_simple}, Déjà récupéré",
-                                             "Échec")
-                            else:
-                                # Fast batch update
-                                st.session_state.sheet.update_cell(student_row, colonne, 1)
-                                st.success(f"✅ Poly {cours_simple} attribué à l'étudiant {numero_adherent_simple} !")
-                                batch_log_activity(st.session_state.username, "Attribution poly simple",
-                                             f"ID: {numero_adherent_simple}, Cours: {cours_simple}",
-                                             "Succès")
-                                
-                                # Clear cache to force refresh on next load
-                                get_all_students_data.clear()
-                        except Exception as e:
-                            st.error(f"❌ Erreur lors de la mise à jour : {e}")
-                            batch_log_activity(st.session_state.username, "Attribution poly simple",
-                                         f"ID: {numero_adherent_simple}, Cours: {cours_simple}, Erreur: {str(e)}",
-                                         "Échec")
-                    else:
-                        st.error(f"⚠️ Le cours '{cours_simple}' n'existe pas dans la base.")
-                        if len(liste_cours) > 1:
-                            st.info("Cours disponibles : " + ", ".join(liste_cours[1:]))
-                else:
-                    st.error(f"❌ Numéro d'adhérent {numero_adherent_simple} non trouvé.")
-                    batch_log_activity(st.session_state.username, "Vérification simple",
-                                 f"ID: {numero_adherent_simple} non trouvé", "Échec")
-            elif not numero_adherent_simple:
-                st.warning("⚠️ Veuillez saisir un numéro d'adhérent.")
-            else:
-                st.warning("⚠️ Veuillez saisir le nom du cours.")
+        simple_attribution(liste_cours)
         
+        with st.expander("Distribution groupée"):
+            cours_groupe = st.selectbox("Cours", liste_cours[1:], key="cours_groupe")
+            render_bulk_distribution(cours_groupe, liste_cours, students_index, key="admin")
+
         # Force flush logs before page exit
-        if st.session_state.get('pending_logs'):
-            flush_pending_logs()
+        flush_pending_logs()
 
     with tab2:
         if st.session_state.username not in st.session_state.is_admin:
@@ -572,7 +839,7 @@ if st.session_state.username in st.session_state.is_admin:
             with backup_cols[0]:
                 if st.button("Télécharger toutes les données (CSV)"):
                     try:
-                        all_data = st.session_state.sheet.get_all_records()
+                        all_data = get_data_service().sheet.get_all_records()
                         df = pd.DataFrame(all_data)
                         st.download_button(
                             "Confirmer le téléchargement",
@@ -587,8 +854,8 @@ if st.session_state.username in st.session_state.is_admin:
             with backup_cols[1]:
                 if st.button("Télécharger les journaux d'activité"):
                     try:
-                        all_logs = st.session_state.log_sheet.get_all_records()
-                        df_logs = pd.DataFrame(all_logs)
+                        all_logs = load_log_store().values()
+                        df_logs = pd.DataFrame(all_logs[1:], columns=all_logs[0] if all_logs else LOG_HEADER)
                         st.download_button(
                             "Confirmer le téléchargement",
                             data=df_logs.to_csv(index=False).encode('utf-8'),
@@ -598,56 +865,65 @@ if st.session_state.username in st.session_state.is_admin:
                     except Exception as e:
                         st.error(f"Erreur d'export: {e}")
 
+            if st.button("🔄 Recharger les données étudiants et les journaux depuis Google Sheets"):
+                load_student_index(force_reload=True)
+                load_log_store(force_reload=True)
+                st.success("✅ Données étudiants et journaux rechargés")
+
             admin_tabs = st.tabs(["Tableau de bord", "Journaux d'activité", "Gestion des utilisateurs",
-                                  "Gestion des cours", "Recherche d'étudiants"])
+                                  "Gestion des cours", "Recherche d'étudiants", "Performance"])
             # pompompidou
 
             # 1. DASHBOARD TAB
             with admin_tabs[0]:
                 st.header("Tableau de bord")
                 try:
-                    all_data = st.session_state.sheet.get_all_records()
-                    total_students = len(all_data)
-                    total_polys = sum(1 for row in all_data for col, val in row.items() if val == 1)
+                    students_index = load_student_index()
+                    log_store = load_log_store()
+                    dashboard = build_dashboard(students_index.version, len(log_store), students_index, log_store)
                     nbLAS, nbPOLY, tauxREUSSITE = st.columns(3)
 
                     with nbLAS:
-                        st.metric("Total de LAS inscrits", total_students)
+                        st.metric("Total de LAS inscrits", dashboard["total_students"])
                     with nbPOLY:
-                        st.metric("Total de polys distribués", total_polys)
+                        st.metric("Total de polys distribués", dashboard["total_polys"])
                     with tauxREUSSITE:
-                        all_logs = st.session_state.log_sheet.get_all_records()
-
-                        success_count = len([log for log in all_logs if log['Statut'] == 'Succès'])
-                        failure_count = len([log for log in all_logs if log['Statut'] == 'Échec'])
-                        total_actions = len(all_logs)
+                        total_actions = int(dashboard["status_counts"].sum())
 
                         if total_actions > 0:
-                            success_rate = (success_count / total_actions) * 100
+                            success_rate = (dashboard["status_counts"].get("Succès", 0) / total_actions) * 100
                             st.metric("Taux de réussite", f"{success_rate:.1f}%")
 
-                    course_counts = {}
-                    for row in all_data:
-                        for course, val in row.items():
-                            if val == 1 and course != st.session_state.sheet.cell(1, 1).value:
-                                course_counts[course] = course_counts.get(course, 0) + 1
-                    
-                    activity_counts = {}
-                    for log in all_logs:
-                        date = log['Date']
-                        activity_counts[date] = activity_counts.get(date, 0) + 1
-
-                    chart_data = pd.DataFrame({
-                        'Date': activity_counts.keys(),
-                        'Activités': activity_counts.values()
-                    })
+                    st.subheader("Polys distribués par cours")
+                    st.bar_chart(dashboard["course_counts"])
 
                     st.subheader("Activité par jour")
-                    st.bar_chart(chart_data.set_index('Date'))
+                    st.bar_chart(dashboard["per_day"])
+
+                    st.subheader("Activité par utilisateur")
+                    st.bar_chart(dashboard["per_user"])
 
                     st.subheader("Activité récente")
-                    recent_logs = sorted(all_logs, key=lambda x: (x['Date'], x['Heure']), reverse=True)[:10]
-                    st.dataframe(pd.DataFrame(recent_logs), use_container_width=True)
+                    st.dataframe(dashboard["recent"], use_container_width=True)
+
+                    if SHEETS_BACKEND != "fake":
+                        st.subheader("Quota Google Sheets")
+                        st.dataframe(pd.DataFrame(get_gspread_client().quota.snapshot()), hide_index=True,
+                                     use_container_width=True)
+                    service = get_data_service()
+                    conflicts = service.ledger.counts().get("conflict", 0)
+                    if conflicts:
+                        st.warning(f"⚠️ {conflicts} distribution(s) en conflit avec la feuille, non écrites : "
+                                   f"à vérifier à la main.")
+                        st.dataframe(pd.DataFrame(service.ledger.conflicts()).assign(
+                            created_at=lambda df: pd.to_datetime(df["created_at"], unit="s")).rename(columns={
+                                "numero": "Numéro d'adhérent", "course": "Cours", "username": "Utilisateur",
+                                "created_at": "Date", "last_error": "Motif"}),
+                                     hide_index=True, use_container_width=True)
+                    for label, writer in [("Synchronisation des polys", service.sync_worker),
+                                          ("Envoi des logs", service.log_shipper)]:
+                        if writer.last_error:
+                            st.warning(f"⚠️ {label}: {writer.last_error}")
                 except Exception as e:
                     st.error(f"Erreur lors de l'affichage de l'activité récente: {e}")
 
@@ -656,50 +932,47 @@ if st.session_state.username in st.session_state.is_admin:
                 st.header("Journal d'activité")
 
                 try:
-                    all_logs = st.session_state.log_sheet.get_all_records()
+                    log_store = load_log_store()
 
-                    if not all_logs:
+                    if not len(log_store):
                         st.info("Aucune activité enregistrée pour le moment.")
                     else:
                         col1, col2 = st.columns(2)
 
                         with col1:
-                            usernames = list(set(log['Utilisateur'] for log in all_logs))
                             selected_user = st.selectbox("Filtrer par utilisateur:",
-                                                         ["Tous les utilisateurs"] + usernames)
+                                                         ["Tous les utilisateurs"] + log_store.users())
 
                         with col2:
-                            actions = list(set(log['Action'] for log in all_logs))
                             selected_action = st.selectbox("Filtrer par type d'action:",
-                                                           ["Toutes les actions"] + actions)
+                                                           ["Toutes les actions"] + log_store.actions())
 
+                        min_date, max_date = log_store.date_bounds()
                         start_date, end_date = st.columns(2)
                         with start_date:
-                            min_date = datetime.datetime.strptime(min(log['Date'] for log in all_logs),
-                                                                  "%d/%m/%Y").date()
                             date_debut = st.date_input("Date de début:", min_date)
 
                         with end_date:
-                            max_date = datetime.datetime.strptime(max(log['Date'] for log in all_logs),
-                                                                  "%d/%m/%Y").date()
                             date_fin = st.date_input("Date de fin:", max_date)
                         # pompompidou
 
-                        filtered_logs = all_logs
-
-                        if selected_user != "Tous les utilisateurs":
-                            filtered_logs = [log for log in filtered_logs if log['Utilisateur'] == selected_user]
+                        page_size_col, page_col = st.columns(2)
+                        with page_size_col:
+                            page_size = st.selectbox("Lignes par page:", [50, 100, 200, 500])
 
-                        if selected_action != "Toutes les actions":
-                            filtered_logs = [log for log in filtered_logs if log['Action'] == selected_action]
-
-                        filtered_logs = [
-                            log for log in filtered_logs
-                            if datetime.datetime.strptime(log['Date'], "%d/%m/%Y").date() >= date_debut
-                               and datetime.datetime.strptime(log['Date'], "%d/%m/%Y").date() <= date_fin
-                        ]
+                        filters = dict(
+                            user=None if selected_user == "Tous les utilisateurs" else selected_user,
+                            action=None if selected_action == "Toutes les actions" else selected_action,
+                            date_from=date_debut,
+                            date_to=date_fin,
+                        )
+                        total, _ = log_store.query(limit=1, **filters)
+                        page_count = max(1, -(-total // page_size))
+                        with page_col:
+                            page = st.number_input(f"Page (sur {page_count}):", min_value=1, max_value=page_count,
+                                                   value=1)
 
-                        if not filtered_logs:
+                        if not total:
                             st.warning("Aucune activité correspondant aux critères sélectionnés.")
                         else:
                             def color_status(status):
@@ -709,16 +982,29 @@ if st.session_state.username in st.session_state.is_admin:
                                     return "background-color: #FFCCCC"
                                 return ""
 
-
-                            df_logs = pd.DataFrame(filtered_logs)
+                            _, page_logs = log_store.query(offset=(page - 1) * page_size, limit=page_size,
+                                                           **filters)
+                            st.caption(f"{total} activité(s) trouvée(s)")
+                            df_logs = pd.DataFrame(page_logs, columns=log_store.header)
                             st.dataframe(df_logs.style.applymap(color_status, subset=['Statut']),
                                          height=400, use_container_width=True)
 
-                            st.download_button(
-                                label="📥 Télécharger les logs filtrés (CSV)",
-                                data=df_logs.to_csv(index=False).encode('utf-8'),
-                                file_name=f"logs_CREM_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                                mime="text/csv")
+                            # The full CSV is built on request only, and kept until the filters or the logs change
+                            export_key = (tuple(filters.items()), len(log_store))
+                            export = st.session_state.get("log_export")
+                            if export is None or export[0] != export_key:
+                                export = None
+                                if st.button("Préparer l'export CSV"):
+                                    _, filtered_logs = log_store.query(**filters)
+                                    export = (export_key, pd.DataFrame(filtered_logs, columns=log_store.header)
+                                              .to_csv(index=False).encode('utf-8'))
+                                    st.session_state.log_export = export
+                            if export is not None:
+                                st.download_button(
+                                    label="📥 Télécharger les logs filtrés (CSV)",
+                                    data=export[1],
+                                    file_name=f"logs_CREM_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                                    mime="text/csv")
                 except Exception as e:
                     st.error(f"❌ Erreur lors de la récupération des logs: {e}")
 
@@ -764,14 +1050,37 @@ if st.session_state.username in st.session_state.is_admin:
                 st.header("Gestion des cours")
 
                 try:
-                    courses = st.session_state.sheet.row_values(1)[1:]
-
-                    course_data = []
-                    for i, course in enumerate(courses):
-                        count = len([1 for cell in st.session_state.sheet.col_values(i + 2)[1:] if cell == '1'])
-                        course_data.append({"Cours": course, "Polys distribués": count})
-
-                    st.dataframe(pd.DataFrame(course_data), use_container_width=True)
+                    students_index = load_student_index()
+                    courses = students_index.courses
+                    printed_counts = get_printed_counts() if get_data_service().online else {}
+                    stats = course_statistics(students_index.version, students_index, printed_counts)
+
+                    stock, distribues = st.columns(2)
+                    with stock:
+                        st.metric("Polys restants", int(stats["Restants"].sum()) if printed_counts else "—")
+                    with distribues:
+                        st.metric("Polys distribués", int(stats["Polys distribués"].sum()))
+
+                    # Only the printed count is editable, the rest comes from the index
+                    edited_stats = st.data_editor(
+                        stats, use_container_width=True, hide_index=True,
+                        disabled=["Cours", "Polys distribués", "Restants"], key="course_stats"
+                    )
+                    low_stock = stats[stats["Restants"].fillna(1) <= 0]["Cours"].tolist()
+                    if low_stock:
+                        st.warning("⚠️ Plus assez de polys pour : " + ", ".join(low_stock))
+
+                    if st.button("Enregistrer le nombre de polys imprimés"):
+                        try:
+                            save_printed_counts({
+                                row["Cours"]: int(row["Imprimés"]) if pd.notna(row["Imprimés"]) else None
+                                for _, row in edited_stats.iterrows()
+                            })
+                            log_activity(st.session_state.username, "Mise à jour du stock", "", "Succès")
+                            st.success("✅ Stock enregistré !")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"❌ Erreur: {e}")
 
                     st.subheader("Ajouter un nouveau cours")
                     new_course = st.text_input("Nom du nouveau cours")
@@ -781,7 +1090,8 @@ if st.session_state.username in st.session_state.is_admin:
                                 if new_course in courses:
                                     st.error(f"Le cours '{new_course}' existe déjà!")
                                 else:
-                                    st.session_state.sheet.update_cell(1, len(courses) + 2, new_course)
+                                    get_data_service().sheet.update_cell(1, len(courses) + 2, new_course)
+                                    load_student_index().add_course(new_course)
                                     log_activity(st.session_state.username, "Ajout de cours", f"Cours: {new_course}",
                                                  "Succès")
                                     st.success(f"✅ Cours '{new_course}' ajouté avec succès!")
@@ -800,14 +1110,13 @@ if st.session_state.username in st.session_state.is_admin:
                 st.header("Recherche et gestion d'étudiants")
 
                 try:
-                    all_students = st.session_state.sheet.get_all_records()
-                    id_field = st.session_state.sheet.cell(1, 1).value
+                    students_index = load_student_index()
+                    id_field = students_index.id_field
 
                     search_term = st.text_input("Rechercher un étudiant par numéro CREM")
 
                     if search_term:
-                        results = [student for student in all_students
-                                   if search_term.lower() in str(student.get(id_field, '')).lower()]
+                        results = students_index.search(search_term)
 
                         if results:
                             st.write(f"{len(results)} résultat(s) trouvé(s)")
@@ -819,26 +1128,30 @@ if st.session_state.username in st.session_state.is_admin:
                             )
 
                             if student_id:
-                                student_row = st.session_state.sheet.find(student_id).row
-                                courses = st.session_state.sheet.row_values(1)[1:]
+                                courses = students_index.courses
 
                                 st.write("Cochez les polys récupérés:")
+                                st.caption(f"{students_index.student_total(student_id)} poly(s) reçu(s) "
+                                           f"sur {len(courses)}")
                                 cols = st.columns(3)
                                 updated_values = {}
 
                                 for i, course in enumerate(courses):
                                     col_index = i % 3
-                                    current_val = st.session_state.sheet.cell(student_row, i + 2).value
                                     with cols[col_index]:
                                         has_poly = st.checkbox(
                                             course,
-                                            value=True if current_val == '1' else False
+                                            value=students_index.has_poly(student_id, course)
                                         )
                                         updated_values[i + 2] = '1' if has_poly else ''
 
                                 if st.button("Mettre à jour"):
-                                    for col, val in updated_values.items():
-                                        st.session_state.sheet.update_cell(student_row, col, val)
+                                    # Only changed cells, written together in one batch_update
+                                    changes = [(student_id, courses[col - 2], val)
+                                               for col, val in updated_values.items()
+                                               if (val == '1') != students_index.has_poly(student_id, courses[col - 2])]
+                                    if changes:
+                                        get_backend().set_many(changes, username=st.session_state.username)
                                     log_activity(st.session_state.username, "Modification étudiant",
                                                  f"ID: {student_id}", "Succès")
                                     st.success("✅ Informations mises à jour!")
@@ -852,16 +1165,14 @@ if st.session_state.username in st.session_state.is_admin:
                         if st.button("Ajouter"):
                             if new_student_id:
                                 try:
-                                    existing = None
-                                    try:
-                                        existing = st.session_state.sheet.find(new_student_id)
-                                    except:
-                                        pass
-
-                                    if existing:
+                                    if new_student_id in students_index:
                                         st.error(f"Un étudiant avec l'ID '{new_student_id}' existe déjà!")
                                     else:
-                                        st.session_state.sheet.append_row([new_student_id] + [''] * (len(st.session_state.sheet.row_values(1)) - 1))
+                                        response = get_data_service().sheet.append_row(
+                                            [new_student_id] + [''] * len(students_index.courses))
+                                        students_index.add_student(
+                                            new_student_id,
+                                            row_from_range(response.get("updates", {}).get("updatedRange")))
                                         log_activity(st.session_state.username, "Ajout étudiant",
                                                      f"ID: {new_student_id}", "Succès")
                                         st.success(f"✅ Étudiant '{new_student_id}' ajouté avec succès!")
@@ -871,6 +1182,46 @@ if st.session_state.username in st.session_state.is_admin:
                                 st.error("Veuillez saisir un numéro d'adhérent")
                 except Exception as e:
                     st.error(f"❌ Erreur lors de la recherche d'étudiants: {e}")
+
+            # 6. PERFORMANCE TAB
+            with admin_tabs[5]:
+                st.header("Performance")
+                st.caption("Mesures du processus depuis son démarrage : décodage, appels Google Sheets, cache "
+                           "des étudiants et attributions par tuteur.")
+
+                timings = pd.DataFrame(METRICS.snapshot())
+                if timings.empty:
+                    st.info("Aucune mesure pour le moment.")
+                else:
+                    mesures = sorted(timings["Mesure"].unique())
+                    selected = st.multiselect("Mesures affichées:", mesures, default=mesures)
+                    st.dataframe(timings[timings["Mesure"].isin(selected)], hide_index=True,
+                                 use_container_width=True)
+
+                counters = pd.DataFrame(METRICS.counters())
+                if not counters.empty:
+                    st.subheader("Compteurs")
+                    st.dataframe(counters, hide_index=True, use_container_width=True)
+
+                stages = pd.DataFrame(SCAN_STATS.snapshot())
+                if not stages.empty:
+                    st.subheader("Étapes de décodage")
+                    st.dataframe(stages, hide_index=True, use_container_width=True)
+                    hits = SYMBOLOGY_ORDER.hits()
+                    st.caption("Ordre des décodeurs : " + " → ".join(
+                        f"{symbology} ({hits[symbology]} codes)" for symbology in SYMBOLOGY_ORDER.order()))
+                decode_pool = get_decode_pool()
+                if decode_pool:
+                    st.caption(f"Décodage : {decode_pool.processes} processus, {decode_pool.pending} scans en cours "
+                               f"(au plus {decode_pool.max_pending}, abandon après {decode_pool.timeout:g} s)")
+
+                export_prometheus, export_json = st.columns(2)
+                with export_prometheus:
+                    st.download_button("📥 Exporter (Prometheus)", data=METRICS.to_prometheus().encode('utf-8'),
+                                       file_name="crem_metrics.prom", mime="text/plain")
+                with export_json:
+                    st.download_button("📥 Exporter (JSON)", data=METRICS.to_json().encode('utf-8'),
+                                       file_name="crem_metrics.json", mime="application/json")
 # pompompidou
 
 st.write(
@@ -893,3 +1244,6 @@ with propos:
         st.write("<3")
 
 # Mathéo Milley-Arjaliès, Webmaster au CREM, référent SHS au Tutorat
+
+METRICS.observe("script_run", (time.perf_counter() - run_started) * 1000,
+                page="admin" if st.session_state.username in st.session_state.is_admin else "tuteur")
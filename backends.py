@@ -0,0 +1,347 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from storage import ALREADY_TAKEN, GRANTED, UNKNOWN, grant_poly, grant_polys, is_taken, normalize_id
+
+
+class StorageBackend(ABC):
+    """
+    Data operations of the distribution flow, independent of where the data lives.
+    Student rows are identified by CREM number, attributions by (numero, course).
+    """
+
+    @abstractmethod
+    def load(self, values):
+        """Seed the store from sheet-like values: header row, then one row per student"""
+
+    @abstractmethod
+    def courses(self):
+        """Course names, in column order"""
+
+    @abstractmethod
+    def find_student(self, numero_adherent):
+        """True if the CREM number is registered"""
+
+    @abstractmethod
+    def has_poly(self, numero_adherent, course):
+        """True if the student already has this poly"""
+
+    def grant(self, numero_adherent, course, username=None):
+        """Atomically hand out one poly; returns GRANTED, ALREADY_TAKEN or UNKNOWN"""
+        return self.grant_many([numero_adherent], course, username)[0][1]
+
+    @abstractmethod
+    def grant_many(self, numeros, course, username=None):
+        """Hand out one poly per CREM number; returns (numero, status) pairs in input order"""
+
+    def set_poly(self, numero_adherent, course, value, username=None):
+        """Overwrite an attribution (admin edit); an empty value makes it available again"""
+        self.set_many([(numero_adherent, course, value)], username)
+
+    @abstractmethod
+    def set_many(self, entries, username=None):
+        """Overwrite (numero, course, value) attributions together; unknown students or courses are skipped"""
+
+    @abstractmethod
+    def append_logs(self, rows):
+        """Store activity log rows (Date, Heure, Utilisateur, Action, Détails, Statut)"""
+
+    @abstractmethod
+    def course_counts(self):
+        """Polys handed out per course"""
+
+
+class SheetsBackend(StorageBackend):
+    """
+    Google Sheets through the shared DataService: reads come from the student
+    index, writes go to the ledger and are synced to the sheet in the background.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def load(self, values):
+        self.service.students.load(values)
+
+    def courses(self):
+        return list(self.service.students.courses)
+
+    def find_student(self, numero_adherent):
+        return numero_adherent in self.service.students
+
+    def has_poly(self, numero_adherent, course):
+        return self.service.students.has_poly(numero_adherent, course)
+
+    def grant(self, numero_adherent, course, username=None):
+        index = self.service.students
+        row, col = index.find_row(numero_adherent), index.column(course)
+        if row is None or col is None:
+            return UNKNOWN
+        if not grant_poly(index, self.service.ledger, numero_adherent, course, row, col, username=username):
+            return ALREADY_TAKEN
+        self.service.sync_worker.notify()
+        return GRANTED
+
+    def grant_many(self, numeros, course, username=None):
+        col = self.service.students.column(course)
+        if col is None:
+            return [(numero_adherent, UNKNOWN) for numero_adherent in numeros]
+        report = grant_polys(self.service.students, self.service.ledger, numeros, course, col, username=username)
+        self.service.sync_worker.notify()
+        return report
+
+    def set_many(self, entries, username=None):
+        index = self.service.students
+        located = [(numero_adherent, course, index.find_row(numero_adherent), index.column(course), value)
+                   for numero_adherent, course, value in entries]
+        located = [entry for entry in located if entry[2] is not None and entry[3] is not None]
+        if not located:
+            return
+        # One ledger transaction, synced as one batch_update
+        self.service.ledger.record_many(located, username=username)
+        for numero_adherent, course, _, _, value in located:
+            index.set_poly(numero_adherent, course, value)
+        self.service.sync_worker.notify()
+
+    def append_logs(self, rows):
+        for row in rows:
+            self.service.log_shipper.add(row)
+
+    def course_counts(self):
+        return self.service.students.course_totals()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Self-contained local store for high-throughput use and load tests: one
+    connection per thread, WAL journal, attributions claimed with a single upsert.
+    """
+
+    def __init__(self, path, synchronous="NORMAL"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS students (numero TEXT PRIMARY KEY, position INTEGER);
+            CREATE TABLE IF NOT EXISTS courses (name TEXT PRIMARY KEY, position INTEGER);
+            CREATE TABLE IF NOT EXISTS polys (
+                numero TEXT NOT NULL,
+                course TEXT NOT NULL,
+                value TEXT NOT NULL,
+                username TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (numero, course)
+            );
+            CREATE TABLE IF NOT EXISTS logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT, heure TEXT, utilisateur TEXT, action TEXT, details TEXT, statut TEXT
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    def load(self, values):
+        header = list(values[0]) if values else []
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO courses (name, position) VALUES (?, ?)",
+                             [(course, i) for i, course in enumerate(header[1:])])
+            now = time.time()
+            for position, row in enumerate(values[1:]):
+                if not row or not str(row[0]).strip():
+                    continue
+                numero = normalize_id(row[0])
+                conn.execute("INSERT OR IGNORE INTO students (numero, position) VALUES (?, ?)", (numero, position))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO polys (numero, course, value, updated_at) VALUES (?, ?, ?, ?)",
+                    [(numero, course, str(value), now) for course, value in zip(header[1:], row[1:]) if value != ''])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def courses(self):
+        return [name for (name,) in self._conn().execute("SELECT name FROM courses ORDER BY position")]
+
+    def find_student(self, numero_adherent):
+        return self._conn().execute("SELECT 1 FROM students WHERE numero = ?",
+                                    (normalize_id(numero_adherent),)).fetchone() is not None
+
+    def has_poly(self, numero_adherent, course):
+        row = self._conn().execute("SELECT value FROM polys WHERE numero = ? AND course = ?",
+                                   (normalize_id(numero_adherent), course)).fetchone()
+        return bool(row) and is_taken(row[0])
+
+    def grant_many(self, numeros, course, username=None):
+        conn = self._conn()
+        report = []
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            known_course = conn.execute("SELECT 1 FROM courses WHERE name = ?", (course,)).fetchone()
+            for numero_adherent in numeros:
+                numero = normalize_id(numero_adherent)
+                if not known_course or not conn.execute("SELECT 1 FROM students WHERE numero = ?",
+                                                        (numero,)).fetchone():
+                    report.append((numero_adherent, UNKNOWN))
+                    continue
+                cursor = conn.execute(
+                    "INSERT INTO polys (numero, course, value, username, updated_at) VALUES (?, ?, '1', ?, ?) "
+                    "ON CONFLICT (numero, course) DO UPDATE SET value = '1', username = excluded.username, "
+                    "updated_at = excluded.updated_at WHERE CAST(polys.value AS REAL) < 1 OR polys.value = ''",
+                    (numero, course, username, now))
+                report.append((numero_adherent, GRANTED if cursor.rowcount else ALREADY_TAKEN))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return report
+
+    def set_many(self, entries, username=None):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO polys (numero, course, value, username, updated_at) SELECT ?, ?, ?, ?, ? "
+                "WHERE EXISTS (SELECT 1 FROM students WHERE numero = ?1) "
+                "AND EXISTS (SELECT 1 FROM courses WHERE name = ?2)",
+                [(normalize_id(numero_adherent), course, '' if value is None else str(value), username, now)
+                 for numero_adherent, course, value in entries])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append_logs(self, rows):
+        self._conn().executemany(
+            "INSERT INTO logs (date, heure, utilisateur, action, details, statut) VALUES (?, ?, ?, ?, ?, ?)",
+            [(list(row) + [''] * 6)[:6] for row in rows])
+
+    def course_counts(self):
+        counts = dict(self._conn().execute(
+            "SELECT course, COUNT(*) FROM polys WHERE value != '' AND CAST(value AS REAL) >= 1 GROUP BY course"))
+        return {course: counts.get(course, 0) for course in self.courses()}
+
+
+class QuotaExceeded(Exception):
+    """Simulated 429 answer; is_retryable() treats it like the real one"""
+
+    def __init__(self, message="Quota exceeded (simulé)"):
+        super().__init__(message)
+        self.response = type("Response", (), {"status_code": 429})()
+
+
+class SimulatedApi:
+    """
+    Remote API behaviour shared by the fakes: every call waits `latency` seconds
+    (a number, or a (min, max) range) and fails with QuotaExceeded at `quota_error_rate`.
+    """
+
+    def __init__(self, latency=0.0, quota_error_rate=0.0, seed=None):
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.calls = 0
+        self.quota_errors = 0
+        self._random = random.Random(seed)
+        self._api_lock = threading.Lock()
+
+    def _call(self):
+        with self._api_lock:
+            self.calls += 1
+            delay = self._random.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+            failed = self._random.random() < self.quota_error_rate
+            if failed:
+                self.quota_errors += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise QuotaExceeded()
+
+
+class MemoryBackend(SimulatedApi, StorageBackend):
+    """In-memory fake for tests and benchmarks, answering like a remote API (see SimulatedApi)"""
+
+    def __init__(self, latency=0.0, quota_error_rate=0.0, seed=None):
+        super().__init__(latency, quota_error_rate, seed)
+        self._lock = threading.Lock()
+        self._courses = []
+        self._students = set()
+        self._polys = {}
+        self._logs = []
+
+    def load(self, values):
+        header = list(values[0]) if values else []
+        with self._lock:
+            self._courses = header[1:]
+            for row in values[1:]:
+                if row and str(row[0]).strip():
+                    numero = normalize_id(row[0])
+                    self._students.add(numero)
+                    for course, value in zip(self._courses, row[1:]):
+                        if value != '':
+                            self._polys[(numero, course)] = str(value)
+
+    def courses(self):
+        self._call()
+        return list(self._courses)
+
+    def find_student(self, numero_adherent):
+        self._call()
+        return normalize_id(numero_adherent) in self._students
+
+    def has_poly(self, numero_adherent, course):
+        self._call()
+        return is_taken(self._polys.get((normalize_id(numero_adherent), course)))
+
+    def grant_many(self, numeros, course, username=None):
+        self._call()
+        report = []
+        with self._lock:
+            for numero_adherent in numeros:
+                key = (normalize_id(numero_adherent), course)
+                if key[0] not in self._students or course not in self._courses:
+                    report.append((numero_adherent, UNKNOWN))
+                elif is_taken(self._polys.get(key)):
+                    report.append((numero_adherent, ALREADY_TAKEN))
+                else:
+                    self._polys[key] = '1'
+                    report.append((numero_adherent, GRANTED))
+        return report
+
+    def set_many(self, entries, username=None):
+        self._call()
+        with self._lock:
+            for numero_adherent, course, value in entries:
+                key = (normalize_id(numero_adherent), course)
+                if key[0] in self._students and course in self._courses:
+                    self._polys[key] = '' if value is None else str(value)
+
+    def append_logs(self, rows):
+        self._call()
+        with self._lock:
+            self._logs.extend(list(row) for row in rows)
+
+    def course_counts(self):
+        self._call()
+        with self._lock:
+            counts = {course: 0 for course in self._courses}
+            for (_, course), value in self._polys.items():
+                if course in counts and is_taken(value):
+                    counts[course] += 1
+            return counts
@@ -0,0 +1,246 @@
+"""
+Load test of the distribution path, run outside Streamlit:
+
+    python bench.py --images 200 --sessions 4 --backend sheets --latency 0.15
+
+A corpus of synthetic student cards (Code 128 barcodes, sharp, blurred, noisy and
+low-light), JPEG-encoded like camera photos, is shared between N concurrent tutor
+sessions running the whole path of the camera tab: scan_image_bytes (image decode
+and decode cache included), student lookup, attribution and activity log, against
+a simulated backend. Each photo is scanned again on the reruns that follow it. Reports p50/p95/p99 per step and per decode strategy, plus
+sustained throughput.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from backends import MemoryBackend, SheetsBackend, SQLiteBackend
+from fake_sheets import FakeSpreadsheet
+from scanner import SCAN_STATS, DecodePool, ScannerBusy, scan_image_bytes
+from storage import GRANTED, DataService
+
+LOG_HEADER = ["Date", "Heure", "Utilisateur", "Action", "Détails", "Statut"]
+
+# Code 128 bar/space widths, symbol values 0-106 (106 is the stop pattern)
+CODE128_PATTERNS = (
+    "212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 221312 231212 112232 122132 "
+    "122231 113222 123122 123221 223211 221132 221231 213212 223112 312131 311222 321122 321221 312212 "
+    "322112 322211 212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 231113 231311 "
+    "112133 112331 132131 113123 113321 133121 313121 211331 231131 213113 213311 213131 311123 311321 "
+    "331121 312113 312311 332111 314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 "
+    "112412 122114 122411 142112 142211 241211 221114 413111 241112 134111 111242 121142 121241 114212 "
+    "124112 124211 411212 421112 421211 212141 214121 412121 111143 111341 131141 114113 114311 411113 "
+    "411311 113141 114131 311141 411131 211412 211214 211232 2331112"
+).split()
+CODE128_START_B = 104
+CODE128_STOP = 106
+
+# Card degradations: (gaussian blur sigma, noise std, brightness factor, night_mode)
+PROFILES = {
+    "net": (0.0, 2.0, 1.0, False),
+    "flou": (2.2, 4.0, 1.0, False),
+    "bruit": (0.6, 28.0, 1.0, False),
+    "sombre": (1.0, 10.0, 0.18, True),
+}
+
+
+def code128_modules(text):
+    """Bar (1) / space (0) modules of `text` encoded with Code 128 set B"""
+    values = [CODE128_START_B] + [ord(c) - 32 for c in text]
+    checksum = (values[0] + sum(i * v for i, v in enumerate(values[1:], start=1))) % 103
+    modules = []
+    for value in values + [checksum, CODE128_STOP]:
+        for i, width in enumerate(CODE128_PATTERNS[value]):
+            modules.extend([1 - i % 2] * int(width))
+    return modules
+
+
+def make_card(numero, profile, rng, module_px=3, height=120):
+    """JPEG photo of a student card carrying `numero` as a Code 128 barcode"""
+    blur, noise, brightness, _ = PROFILES[profile]
+    modules = np.array(code128_modules(numero), dtype=np.uint8)
+    bars = np.repeat(np.where(modules == 1, 20, 235).astype(np.uint8), module_px)
+    card = np.full((height * 3, len(bars) + 40 * module_px + 120), 235, dtype=np.uint8)
+    top, left = height, (card.shape[1] - len(bars)) // 2
+    card[top:top + height, left:left + len(bars)] = bars
+    cv2.putText(card, f"CREM {numero}", (left, top + height + 40), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 20, 2)
+
+    # Slight rotation and a bigger background, like a phone picture
+    angle = rng.uniform(-4, 4)
+    matrix = cv2.getRotationMatrix2D((card.shape[1] / 2, card.shape[0] / 2), angle, 1.0)
+    card = cv2.warpAffine(card, matrix, (card.shape[1], card.shape[0]), borderValue=235)
+    photo = np.full((card.shape[0] + 200, card.shape[1] + 200), 120, dtype=np.uint8)
+    photo[100:100 + card.shape[0], 100:100 + card.shape[1]] = card
+
+    image = photo.astype(np.float32)
+    if blur:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    image = image * brightness + rng.normal(0, noise, image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    return cv2.imencode(".jpg", cv2.cvtColor(image, cv2.COLOR_GRAY2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def make_corpus(count, numeros, seed=0):
+    """(numero, profile, JPEG bytes) tuples cycling through the degradation profiles"""
+    rng = np.random.default_rng(seed)
+    profiles = list(PROFILES)
+    return [(numeros[i % len(numeros)], profiles[i % len(profiles)],
+             make_card(numeros[i % len(numeros)], profiles[i % len(profiles)], rng))
+            for i in range(count)]
+
+
+def make_students(count, courses):
+    """Sheet-like values: header, then one row per student with no poly handed out"""
+    return [["Numéro d'adhérent"] + courses] + [[f"{100000 + i}"] + [''] * len(courses) for i in range(count)]
+
+
+def make_backend(name, values, latency, quota_error_rate, data_dir):
+    if name == "memory":
+        backend = MemoryBackend(latency=latency, quota_error_rate=quota_error_rate, seed=0)
+    elif name == "sqlite":
+        backend = SQLiteBackend(os.path.join(data_dir, "bench.sqlite3"))
+    else:
+        spreadsheet = FakeSpreadsheet({"Sheet1": values, "Logs": [LOG_HEADER]}, latency=latency,
+                                      quota_error_rate=quota_error_rate, seed=0)
+        service = DataService(lambda: (spreadsheet.sheet1, spreadsheet.worksheet("Logs")), data_dir,
+                              log_columns=len(LOG_HEADER)).start()
+        backend = SheetsBackend(service)
+    backend.load(values)
+    return backend
+
+
+class Timings:
+    """Thread-safe lists of durations in milliseconds and outcome counters, by name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+
+    def add(self, name, ms):
+        with self._lock:
+            self.samples.setdefault(name, []).append(ms)
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def summary(self):
+        rows = []
+        for name, values in sorted(self.samples.items()):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            rows.append({"step": name, "n": len(values), "p50_ms": round(float(p50), 2),
+                         "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2),
+                         "max_ms": round(float(max(values)), 2)})
+        return rows
+
+
+def run_session(session, corpus, backend, course, timings, parallel, pool=None, reruns=1):
+    """One tutor working through its share of the queue, like the camera tab does"""
+    username = f"tuteur{session}"
+    for numero, profile, data in corpus:
+        started = time.perf_counter()
+        report = {}
+        try:
+            results, _ = scan_image_bytes(data, PROFILES[profile][3], report=report, parallel=parallel, pool=pool)
+        except ScannerBusy:
+            timings.count("saturé")
+            continue
+        scan_ms = (time.perf_counter() - started) * 1000
+        timings.add("scan", scan_ms)
+        timings.add(f"scan/{profile}", scan_ms)
+        for stage, ms, _ in report["attempts"]:
+            timings.add(f"stratégie/{stage}", ms)
+        # Streamlit reruns the script with the same camera frame, e.g. when the course is picked
+        for _ in range(reruns):
+            step = time.perf_counter()
+            scan_image_bytes(data, PROFILES[profile][3], parallel=parallel, pool=pool)
+            timings.add("scan/cache", (time.perf_counter() - step) * 1000)
+        if not results:
+            timings.count("illisible")
+            continue
+        code = results[0].data.decode("utf-8")
+        timings.count("correct" if code == numero else "erroné")
+
+        step = time.perf_counter()
+        found = backend.find_student(code)
+        timings.add("recherche", (time.perf_counter() - step) * 1000)
+        if not found:
+            continue
+
+        step = time.perf_counter()
+        status = backend.grant(code, course, username=username)
+        timings.add("attribution", (time.perf_counter() - step) * 1000)
+        timings.count(status)
+
+        step = time.perf_counter()
+        backend.append_logs([[time.strftime("%d/%m/%Y"), time.strftime("%H:%M:%S"), username,
+                              "Enregistrement poly", f"ID: {code}, Cours: {course}",
+                              "Succès" if status == GRANTED else "Échec"]])
+        timings.add("log", (time.perf_counter() - step) * 1000)
+        timings.add("total", (time.perf_counter() - started) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du parcours de distribution des polys")
+    parser.add_argument("--images", type=int, default=120, help="taille du corpus de cartes")
+    parser.add_argument("--students", type=int, default=2000, help="nombre d'étudiants simulés")
+    parser.add_argument("--sessions", type=int, default=4, help="tuteurs scannant en parallèle")
+    parser.add_argument("--backend", choices=["sheets", "sqlite", "memory"], default="sheets")
+    parser.add_argument("--latency", type=float, default=0.1, help="latence simulée par appel (s)")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="part d'appels en erreur 429")
+    parser.add_argument("--parallel", action="store_true", help="décodage parallèle des étapes")
+    parser.add_argument("--processes", type=int, default=0, help="processus de décodage (0: dans chaque session)")
+    parser.add_argument("--reruns", type=int, default=1, help="nouveaux scans de la même photo par rerun")
+    parser.add_argument("--json", help="écrire le rapport dans ce fichier JSON")
+    args = parser.parse_args()
+    if args.parallel and args.processes:
+        parser.error("--parallel et --processes s'excluent: un processus de décodage essaie les étapes en série")
+
+    courses = ["UE1", "UE2", "UE3"]
+    values = make_students(args.students, courses)
+    numeros = [row[0] for row in values[1:]]
+    corpus = make_corpus(args.images, numeros)
+    pool = DecodePool(args.processes, max_pending=args.sessions) if args.processes else None
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        backend = make_backend(args.backend, values, args.latency, args.quota_error_rate, data_dir)
+        timings = Timings()
+        shares = [corpus[i::args.sessions] for i in range(args.sessions)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as sessions:
+            for future in [sessions.submit(run_session, i, share, backend, courses[0], timings, args.parallel, pool,
+                                           args.reruns)
+                           for i, share in enumerate(shares)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+    report = {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 2),
+        "scans_per_minute": round(len(corpus) / elapsed * 60, 1),
+        "outcomes": timings.counts,
+        "steps": timings.summary(),
+        "stages": SCAN_STATS.snapshot(),
+    }
+    print(f"{len(corpus)} scans, {args.sessions} sessions, backend {args.backend}: "
+          f"{report['scans_per_minute']} scans/min en {report['elapsed_s']} s")
+    print(json.dumps(timings.counts, ensure_ascii=False))
+    print(f"{'étape':<28}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for row in report["steps"]:
+        print(f"{row['step']:<28}{row['n']:>6}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+              f"{row['max_ms']:>10}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
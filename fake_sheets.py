@@ -0,0 +1,181 @@
+import re
+import threading
+
+import gspread
+
+from backends import SimulatedApi
+from storage import rowcol_to_a1
+
+
+class FakeSheetsUnavailable(ConnectionError):
+    """Raised by every call while the fake spreadsheet is offline"""
+
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter.upper()) - 64
+    return number
+
+
+def parse_range(a1):
+    """A1 range -> (first_row, first_col, last_row, last_col); None for open ends"""
+    bounds = []
+    for part in a1.split(":"):
+        match = re.fullmatch(r"([A-Za-z]*)(\d*)", part)
+        letters, digits = match.groups()
+        bounds.append((int(digits) if digits else None, _column_number(letters) if letters else None))
+    if len(bounds) == 1:
+        bounds.append(bounds[0])
+    (r1, c1), (r2, c2) = bounds
+    return r1 or 1, c1 or 1, r2, c2
+
+
+class FakeWorksheet:
+    """In-memory worksheet answering the subset of the gspread API used by the app"""
+
+    def __init__(self, spreadsheet, title, values=None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self._values = [list(map(str, row)) for row in values or []]
+
+    def _check(self):
+        self.spreadsheet.check()
+
+    def _read(self, a1):
+        r1, c1, r2, c2 = parse_range(a1)
+        last_row = min(r2 or len(self._values), len(self._values))
+        rows = []
+        for row in self._values[r1 - 1:last_row]:
+            rows.append(row[c1 - 1:c2] if c2 else row[c1 - 1:])
+        # Like the API: trailing empty cells and rows are dropped
+        rows = [self._trim(row) for row in rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    @staticmethod
+    def _trim(row):
+        row = list(row)
+        while row and row[-1] == '':
+            row.pop()
+        return row
+
+    def _write(self, row, col, value):
+        while len(self._values) < row:
+            self._values.append([])
+        cells = self._values[row - 1]
+        while len(cells) < col:
+            cells.append('')
+        cells[col - 1] = '' if value is None else str(value)
+
+    def get_all_values(self):
+        self._check()
+        with self.spreadsheet.lock:
+            return [self._trim(row) for row in self._values]
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        header = values[0]
+        return [dict(zip(header, row + [''] * (len(header) - len(row)))) for row in values[1:]]
+
+    def get_values(self, range_name=None):
+        self._check()
+        with self.spreadsheet.lock:
+            return self._read(range_name) if range_name else [self._trim(row) for row in self._values]
+
+    def batch_get(self, ranges):
+        self._check()
+        with self.spreadsheet.lock:
+            return [self._read(a1) for a1 in ranges]
+
+    def row_values(self, row):
+        self._check()
+        with self.spreadsheet.lock:
+            return self._trim(self._values[row - 1]) if row <= len(self._values) else []
+
+    def col_values(self, col):
+        self._check()
+        with self.spreadsheet.lock:
+            values = [row[col - 1] if col <= len(row) else '' for row in self._values]
+        return self._trim(values)
+
+    def cell(self, row, col):
+        values = self.batch_get([rowcol_to_a1(row, col)])[0]
+        return type("Cell", (), {"row": row, "col": col, "value": values[0][0] if values else None})()
+
+    def update(self, range_name=None, values=None):
+        self._check()
+        r1, c1, _, _ = parse_range(range_name or "A1")
+        with self.spreadsheet.lock:
+            for i, row in enumerate(values or []):
+                for j, value in enumerate(row):
+                    self._write(r1 + i, c1 + j, value)
+
+    def update_cell(self, row, col, value):
+        self._check()
+        with self.spreadsheet.lock:
+            self._write(row, col, value)
+
+    def batch_update(self, data):
+        self._check()
+        with self.spreadsheet.lock:
+            for update in data:
+                r1, c1, _, _ = parse_range(update["range"])
+                for i, row in enumerate(update["values"]):
+                    for j, value in enumerate(row):
+                        self._write(r1 + i, c1 + j, value)
+
+    def append_rows(self, rows, **kwargs):
+        self._check()
+        with self.spreadsheet.lock:
+            while self._values and not any(self._values[-1]):
+                self._values.pop()
+            start = len(self._values) + 1
+            self._values.extend([str(v) for v in row] for row in rows)
+        return {"updates": {"updatedRange": f"{self.title}!A{start}:{rowcol_to_a1(start + len(rows) - 1, 26)}"}}
+
+    def append_row(self, row, **kwargs):
+        return self.append_rows([row], **kwargs)
+
+
+class FakeSpreadsheet(SimulatedApi):
+    """
+    Local stand-in for a Google spreadsheet, to run the app without a Google
+    account. Set `online` to False to simulate a network or API outage; latency
+    and 429 quota errors are simulated like in every fake (see SimulatedApi).
+    """
+
+    def __init__(self, worksheets=None, latency=0.0, quota_error_rate=0.0, seed=None):
+        super().__init__(latency, quota_error_rate, seed)
+        self.lock = threading.RLock()
+        self.online = True
+        self._worksheets = []
+        for title, values in (worksheets or {"Sheet1": [["Numéro"]]}).items():
+            self._worksheets.append(FakeWorksheet(self, title, values))
+
+    def check(self):
+        """Simulate the network: outage, latency and quota errors"""
+        if not self.online:
+            raise FakeSheetsUnavailable("Google Sheets injoignable (faux serveur hors ligne)")
+        self._call()
+
+    @property
+    def sheet1(self):
+        self.check()
+        return self._worksheets[0]
+
+    def worksheet(self, title):
+        self.check()
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows=1000, cols=26):
+        with self.lock:
+            worksheet = FakeWorksheet(self, title)
+            self._worksheets.append(worksheet)
+            return worksheet
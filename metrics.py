@@ -0,0 +1,143 @@
+import bisect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Upper bounds in milliseconds of the histogram buckets, like Prometheus "le"
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class Histogram:
+    """
+    Cumulative bucket counts for export, plus the last `window` samples for
+    exact recent percentiles.
+    """
+
+    def __init__(self, window=2000):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, ms):
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        self.max = max(self.max, ms)
+        self.recent.append(ms)
+
+    def percentiles(self, qs=(50, 95, 99)):
+        if not self.recent:
+            return [0.0] * len(qs)
+        return [float(p) for p in np.percentile(self.recent, qs)]
+
+
+class Metrics:
+    """
+    In-process registry of timing histograms and counters, keyed by name and labels.
+    Cheap enough for the hot path: one lock, no I/O.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name, ms, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(ms)
+
+    def count(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block into the `name` histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, **labels)
+
+    def snapshot(self):
+        """One row per histogram, for display in the admin pages"""
+        with self._lock:
+            rows = []
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                p50, p95, p99 = histogram.percentiles()
+                rows.append({
+                    "Mesure": name,
+                    "Étiquettes": ", ".join(f"{k}={v}" for k, v in labels),
+                    "Nombre": histogram.count,
+                    "p50 (ms)": round(p50, 1),
+                    "p95 (ms)": round(p95, 1),
+                    "p99 (ms)": round(p99, 1),
+                    "Max (ms)": round(histogram.max, 1),
+                })
+            return rows
+
+    def counters(self):
+        with self._lock:
+            return [{"Compteur": name, "Étiquettes": ", ".join(f"{k}={v}" for k, v in labels), "Valeur": value}
+                    for (name, labels), value in sorted(self._counters.items())]
+
+    def to_json(self):
+        with self._lock:
+            histograms = [{"name": name, "labels": dict(labels), "count": h.count, "sum_ms": h.sum,
+                           "max_ms": h.max, "buckets": dict(zip(map(str, BUCKETS_MS + ("+Inf",)), h.buckets)),
+                           **dict(zip(("p50_ms", "p95_ms", "p99_ms"), h.percentiles()))}
+                          for (name, labels), h in self._histograms.items()]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self._counters.items()]
+        return json.dumps({"histograms": histograms, "counters": counters}, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix="crem_"):
+        """Prometheus text exposition format; durations are exported in seconds"""
+        def label_text(labels, extra=()):
+            pairs = [f'{k}="{_escape(v)}"' for k, v in tuple(labels) + tuple(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._histograms}):
+                metric = f"{prefix}{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (other, labels), h in sorted(self._histograms.items()):
+                    if other != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket in zip(BUCKETS_MS + (None,), h.buckets):
+                        cumulative += bucket
+                        le = "+Inf" if bound is None else repr(bound / 1000)
+                        lines.append(f"{metric}_bucket{label_text(labels, [('le', le)])} {cumulative}")
+                    lines.append(f"{metric}_sum{label_text(labels)} {h.sum / 1000}")
+                    lines.append(f"{metric}_count{label_text(labels)} {h.count}")
+            for name in sorted({name for name, _ in self._counters}):
+                metric = f"{prefix}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (other, labels), value in sorted(self._counters.items()):
+                    if other == name:
+                        lines.append(f"{metric}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = Metrics()
@@ -0,0 +1,779 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+from pyzbar.pyzbar import decode
+
+from metrics import METRICS
+
+try:
+    from pylibdmtx.pylibdmtx import decode as dmtx_decode
+except ImportError as e:  # libdmtx not installed: Data Matrix cards fall back to manual entry
+    dmtx_decode = None
+    logging.getLogger(__name__).warning("Data Matrix decoding disabled, libdmtx unavailable: %s", e)
+
+# Camera and upload photos are decoded straight to grayscale, reduced by 2, 4 or 8
+# as long as the longest side stays at or above this (thin bars need the pixels)
+INPUT_TARGET_SIDE = 1600
+_REDUCED_GRAYSCALE = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                      4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+# Longest side used for the cheap first decode attempt
+DOWNSCALE_MAX_SIDE = 1000
+
+# Barcode region detection runs on a small copy of the frame
+ROI_DETECT_MAX_SIDE = 640
+ROI_MAX_REGIONS = 3
+ROI_PADDING = 0.15
+
+# Data Matrix runs on downscaled regions with a hard libdmtx time budget per scan
+DMTX_MAX_SIDE = 480
+DMTX_TIMEOUT_MS = 300
+
+# Decode results kept for reruns and re-snapped cards, at most this many entries and image bytes
+DECODE_CACHE_SIZE = 64
+DECODE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# Longest side of the processed image returned after a miss, only shown as a small preview
+PREVIEW_MAX_SIDE = 600
+
+# Shared by every session; OpenCV and zbar release the GIL while they work
+DECODE_WORKERS = min(4, os.cpu_count() or 1)
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+# Worker processes of DecodePool, and how long a session waits for one before giving up
+DECODE_PROCESSES = max(1, (os.cpu_count() or 2) - 1)
+DECODE_TIMEOUT_S = 15.0
+
+
+# Same shape whichever library decoded the code: data is bytes, rect is (left, top, width, height)
+DecodedCode = namedtuple("DecodedCode", ["data", "type", "rect"])
+
+
+class SymbologyOrder:
+    """Decoders tried most-hits first, learned over the process; ties keep the default order"""
+
+    def __init__(self, default=("zbar", "datamatrix")):
+        self.default = list(default)
+        self._lock = threading.Lock()
+        self._hits = dict.fromkeys(default, 0)
+
+    def record(self, symbology):
+        with self._lock:
+            self._hits[symbology] += 1
+
+    def order(self):
+        with self._lock:
+            return sorted(self.default, key=lambda symbology: -self._hits[symbology])
+
+    def hits(self):
+        with self._lock:
+            return dict(self._hits)
+
+
+SYMBOLOGY_ORDER = SymbologyOrder()
+
+
+def decode_zbar(image):
+    """1D codes and QR codes through zbar, as DecodedCode"""
+    return [DecodedCode(r.data, r.type, tuple(r.rect)) for r in decode(image)]
+
+
+def decode_datamatrix(gray, regions=(), timeout_ms=DMTX_TIMEOUT_MS):
+    """
+    Data Matrix through libdmtx, on each region then the whole frame, every
+    candidate downscaled to DMTX_MAX_SIDE; stops once timeout_ms is spent.
+    Returns (results, image) with rect in the coordinates of `gray`.
+    """
+    if dmtx_decode is None:
+        return [], None
+    deadline = time.perf_counter() + timeout_ms / 1000
+    for x, y, w, h in list(regions) + [(0, 0, gray.shape[1], gray.shape[0])]:
+        remaining_ms = int((deadline - time.perf_counter()) * 1000)
+        if remaining_ms <= 0:
+            break
+        candidate = gray[y:y + h, x:x + w]
+        scale = min(1.0, DMTX_MAX_SIDE / max(candidate.shape))
+        if scale < 1.0:
+            candidate = cv2.resize(candidate, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        found = dmtx_decode(np.ascontiguousarray(candidate), timeout=remaining_ms, max_count=1)
+        if found:
+            # libdmtx measures top from the bottom edge
+            height = candidate.shape[0]
+            return [DecodedCode(r.data, "DATAMATRIX",
+                                (x + int(r.rect.left / scale), y + int((height - r.rect.top - r.rect.height) / scale),
+                                 int(r.rect.width / scale), int(r.rect.height / scale)))
+                    for r in found], candidate
+    return [], None
+
+
+def enhance_for_low_light(image, alpha=1.5, beta=10):
+    enhanced = cv2.convertScaleAbs(image, alpha=alpha, beta=beta)
+    return enhanced
+
+
+class ScanStats:
+    """Per-stage attempts, hits and timings aggregated over the whole process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.scans = 0
+        self.misses = 0
+        self.sources = {}
+
+    def record_stage(self, stage, elapsed_ms, hit):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"attempts": 0, "hits": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["attempts"] += 1
+            entry["hits"] += int(hit)
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+
+    def record_scan(self, source):
+        """source is where the code was found ("roi", "full" or "datamatrix"), None on a miss"""
+        with self._lock:
+            self.scans += 1
+            if source is None:
+                self.misses += 1
+            else:
+                self.sources[source] = self.sources.get(source, 0) + 1
+
+    def snapshot(self):
+        """One row per stage, in pipeline order"""
+        with self._lock:
+            return [
+                {
+                    "Étape": stage,
+                    "Tentatives": entry["attempts"],
+                    "Succès": entry["hits"],
+                    "Taux de succès (%)": round(100 * entry["hits"] / entry["attempts"], 1),
+                    "Temps moyen (ms)": round(entry["total_ms"] / entry["attempts"], 1),
+                    "Temps max (ms)": round(entry["max_ms"], 1),
+                }
+                for stage, entry in self.stages.items()
+            ]
+
+
+SCAN_STATS = ScanStats()
+
+
+class _Frame:
+    """
+    Intermediate images of one scan, computed lazily and shared between stages.
+    origin is the top-left corner of `gray` in the scanned image, for region crops.
+    """
+
+    def __init__(self, gray, night_mode, origin=(0, 0)):
+        self.night_mode = night_mode
+        self.origin = origin
+        self._images = {"gray": gray}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        if name not in self._images:
+            # Parallel stages needing the same image wait for a single computation
+            with self._lock:
+                lock = self._locks.setdefault(name, threading.Lock())
+            with lock:
+                if name not in self._images:
+                    self._images[name] = _PREPROCESSORS[name](self)
+        return self._images[name]
+
+    def to_image_coords(self, results, candidate):
+        """Results decoded on a stage image, with rect in the coordinates of the scanned image"""
+        x0, y0 = self.origin
+        scale_y = self._images["gray"].shape[0] / candidate.shape[0]
+        scale_x = self._images["gray"].shape[1] / candidate.shape[1]
+        return [r._replace(rect=(x0 + round(r.rect[0] * scale_x), y0 + round(r.rect[1] * scale_y),
+                                 round(r.rect[2] * scale_x), round(r.rect[3] * scale_y)))
+                for r in results]
+
+
+def _base(frame):
+    gray = frame["gray"]
+    if frame.night_mode:
+        # Apply CLAHE for better contrast in low light
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        gray = clahe.apply(gray)
+
+        # Enhanced brightness/contrast for night mode
+        gray = cv2.convertScaleAbs(gray, alpha=2.0, beta=30)
+    return gray
+
+
+def _downscaled(frame):
+    base = frame["base"]
+    scale = DOWNSCALE_MAX_SIDE / max(base.shape[:2])
+    if scale >= 1:
+        return None
+    return cv2.resize(base, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def _clahe(frame):
+    if frame.night_mode:
+        return None  # Already part of the night mode base image
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return clahe.apply(frame["base"])
+
+
+def _denoised(frame):
+    # Apply noise reduction (reduces camera noise impact)
+    denoised = cv2.fastNlMeansDenoising(frame["base"], None, h=10, templateWindowSize=7, searchWindowSize=21)
+    return cv2.GaussianBlur(denoised, (5, 5), 0)
+
+
+def _thresh(frame):
+    block_size = 15 if frame.night_mode else 11
+    c_value = 7 if frame.night_mode else 2
+    return cv2.adaptiveThreshold(
+        frame["denoised"], 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, block_size, c_value
+    )
+
+
+def _edges(frame):
+    night_mode = frame.night_mode
+    return cv2.Canny(frame["denoised"], 30 if night_mode else 50, 150 if night_mode else 200)
+
+
+def _closing(frame):
+    kernel = np.ones((5, 5) if frame.night_mode else (3, 3), np.uint8)
+    return cv2.morphologyEx(frame["thresh"], cv2.MORPH_CLOSE, kernel)
+
+
+_PREPROCESSORS = {
+    "base": _base,
+    "downscaled": _downscaled,
+    "blurred": lambda frame: cv2.GaussianBlur(frame["base"], (5, 5), 0),
+    "clahe": _clahe,
+    "denoised": _denoised,
+    "thresh": _thresh,
+    # Inverted threshold often helps with certain barcodes
+    "thresh_inv": lambda frame: cv2.bitwise_not(frame["thresh"]),
+    "edges": _edges,
+    "closing": _closing,
+}
+
+# Cheapest stages first; NL-means denoising only runs once they all failed, and
+# Data Matrix is tried in between so a Data Matrix card does not pay for it
+CHEAP_STAGES = ["downscaled", "base", "blurred", "clahe"]
+HEAVY_STAGES = ["denoised", "thresh", "thresh_inv", "edges", "closing"]
+STAGE_ORDER = CHEAP_STAGES + HEAVY_STAGES
+
+# Live video frames are small and plentiful: a miss is cheaper than a slow frame
+LIVE_STAGE_ORDER = ["base", "blurred", "clahe"]
+
+
+_detectors = threading.local()
+
+
+def _opencv_detector():
+    """cv2.barcode.BarcodeDetector when this OpenCV build ships it, one per thread"""
+    if not hasattr(_detectors, "detector"):
+        module = getattr(cv2, "barcode", None)
+        factory = getattr(module, "BarcodeDetector", None) or getattr(cv2, "barcode_BarcodeDetector", None)
+        try:
+            _detectors.detector = factory() if factory else None
+        except cv2.error:
+            _detectors.detector = None
+    return _detectors.detector
+
+
+def _opencv_boxes(small):
+    detector = _opencv_detector()
+    if detector is None:
+        return []
+    try:
+        found, points = detector.detect(small)[:2]
+    except cv2.error:
+        return []
+    if not found or points is None:
+        return []
+    return [cv2.boundingRect(np.int32(quad)) for quad in points]
+
+
+def _gradient_boxes(small, max_regions):
+    """Classic gradient + morphology box detector: barcodes are areas of strong one-directional gradient"""
+    grad_x = cv2.convertScaleAbs(cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=-1))
+    grad_y = cv2.convertScaleAbs(cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=-1))
+    gradient = cv2.blur(cv2.absdiff(grad_x, grad_y), (9, 9))
+    _, thresh = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (21, 7)))
+    closed = cv2.dilate(cv2.erode(closed, None, iterations=4), None, iterations=4)
+    contours = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    min_area = 0.002 * small.size
+    contours = [c for c in sorted(contours, key=cv2.contourArea, reverse=True) if cv2.contourArea(c) >= min_area]
+    return [cv2.boundingRect(c) for c in contours[:max_regions]]
+
+
+def locate_barcode_regions(gray, max_regions=ROI_MAX_REGIONS):
+    """
+    Candidate barcode boxes (x, y, w, h) in full-resolution coordinates, best first.
+    Uses cv2.barcode when available, the gradient detector otherwise.
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, ROI_DETECT_MAX_SIDE / max(height, width))
+    small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    boxes = _opencv_boxes(small) or _gradient_boxes(small, max_regions)
+
+    regions = []
+    for x, y, w, h in boxes[:max_regions]:
+        pad_x, pad_y = int(w / scale * ROI_PADDING) + 8, int(h / scale * ROI_PADDING) + 8
+        x0, y0 = max(0, int(x / scale) - pad_x), max(0, int(y / scale) - pad_y)
+        x1, y1 = min(width, int((x + w) / scale) + pad_x), min(height, int((y + h) / scale) + pad_y)
+        if x1 - x0 >= 16 and y1 - y0 >= 16:
+            regions.append((x0, y0, x1 - x0, y1 - y0))
+    return regions
+
+
+def _try_stage(frame, stage, prefix, attempts, cancelled=None):
+    """Preprocess and decode one stage; returns (results, image), rects in scanned image coordinates"""
+    if cancelled is not None and cancelled.is_set():
+        return None, None
+    start = time.perf_counter()
+    candidate = frame[stage]
+    if candidate is None:
+        return None, None
+    decode_start = time.perf_counter()
+    results = decode_zbar(candidate)
+    end = time.perf_counter()
+    elapsed_ms = (end - start) * 1000
+    METRICS.observe("preprocess", (decode_start - start) * 1000, stage=prefix + stage)
+    METRICS.observe("decode", (end - decode_start) * 1000, stage=prefix + stage)
+    SCAN_STATS.record_stage(prefix + stage, elapsed_ms, bool(results))
+    if attempts is not None:
+        attempts.append((prefix + stage, elapsed_ms, bool(results)))
+    return (frame.to_image_coords(results, candidate) if results else results), candidate
+
+
+def _run_stages(gray, night_mode, attempts, prefix="", parallel=False, stages=None, frame=None):
+    """
+    Try the stages of STAGE_ORDER, or `stages`; returns (results, image, stage, frame).
+    Pass the frame of an earlier call on the same image to reuse its intermediate images.
+    """
+    frame = frame or _Frame(gray, night_mode)
+    stages = stages or STAGE_ORDER
+
+    if not parallel:
+        for stage in stages:
+            results, candidate = _try_stage(frame, stage, prefix, attempts)
+            if results:
+                return results, candidate, prefix + stage, frame
+        return None, None, None, frame
+
+    cancelled = threading.Event()
+    futures = {_decode_pool.submit(_try_stage, frame, stage, prefix, attempts, cancelled): stage for stage in stages}
+    try:
+        for future in as_completed(futures):
+            results, candidate = future.result()
+            if results:
+                return results, candidate, prefix + futures[future], frame
+    finally:
+        # Stages still queued are dropped, running ones finish in the background
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+    return None, None, None, frame
+
+
+def scan_barcode(image, night_mode=False, report=None, use_roi=True, parallel=False, symbologies=None):
+    """
+    Staged barcode scanning: cheap decodes first, heavier preprocessing only on failure.
+    zbar (1D and QR) and libdmtx (Data Matrix) are tried in SYMBOLOGY_ORDER, which
+    follows the hits so far, zbar's heavy stages always last; results are DecodedCode
+    whichever library found them, with rect in the coordinates of `image`.
+    With use_roi the stages run on the detected barcode regions before the whole frame.
+    With parallel the stages of a region run concurrently on the shared decode pool
+    and the first one to decode wins.
+    symbologies overrides that order for this scan.
+    Every attempt is timed in SCAN_STATS; pass a dict as report to get the winning
+    stage and source, the total time and the (stage, ms, hit) attempts of this scan.
+    """
+    start = time.perf_counter()
+    attempts = []
+    results, processed, stage, source = _scan(image, night_mode, attempts, use_roi, parallel, symbologies)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    SCAN_STATS.record_scan(source)
+    METRICS.observe("scan", elapsed_ms, result=stage or "échec")
+    if report is not None:
+        report.update(stage=stage, source=source, elapsed_ms=elapsed_ms, attempts=attempts)
+    return results, processed
+
+
+def _scan(image, night_mode, attempts, use_roi, parallel, symbologies=None):
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    regions = []
+    if use_roi:
+        start = time.perf_counter()
+        regions = locate_barcode_regions(gray)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        SCAN_STATS.record_stage("roi/detect", elapsed_ms, bool(regions))
+        attempts.append(("roi/detect", elapsed_ms, bool(regions)))
+
+    order = [symbology for symbology in symbologies or SYMBOLOGY_ORDER.order()
+             if symbology != "datamatrix" or dmtx_decode is not None]
+    passes = [(symbology, CHEAP_STAGES) for symbology in order]
+    if "zbar" in order:
+        passes.append(("zbar", HEAVY_STAGES))
+
+    frames = {}  # zbar frames per region, shared by the cheap and the heavy pass
+    for symbology, stages in passes:
+        if symbology == "datamatrix":
+            start = time.perf_counter()
+            results, processed = decode_datamatrix(gray, regions)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            SCAN_STATS.record_stage("datamatrix", elapsed_ms, bool(results))
+            METRICS.observe("decode", elapsed_ms, stage="datamatrix")
+            attempts.append(("datamatrix", elapsed_ms, bool(results)))
+            if results:
+                SYMBOLOGY_ORDER.record(symbology)
+                return results, processed, "datamatrix", "datamatrix"
+        else:
+            results, processed, stage, source = _scan_zbar(gray, regions, night_mode, attempts, parallel,
+                                                           stages, frames)
+            if results:
+                SYMBOLOGY_ORDER.record(symbology)
+                return results, processed, stage, source
+
+    # If all methods fail
+    return None, frames[None]["denoised"] if None in frames else None, None, None
+
+
+def _scan_zbar(gray, regions, night_mode, attempts, parallel, stages, frames):
+    for x, y, w, h in regions:
+        frame = frames.setdefault((x, y, w, h), _Frame(gray[y:y + h, x:x + w], night_mode, origin=(x, y)))
+        results, processed, stage, _ = _run_stages(None, night_mode, attempts, prefix="roi/", parallel=parallel,
+                                                   stages=stages, frame=frame)
+        if results:
+            return results, processed, stage, "roi"
+
+    # Fall back to the full frame
+    frame = frames.setdefault(None, _Frame(gray, night_mode))
+    results, processed, stage, _ = _run_stages(None, night_mode, attempts, parallel=parallel, stages=stages,
+                                               frame=frame)
+    if results:
+        return results, processed, stage, "full"
+    return None, None, None, None
+
+
+class ScannerBusy(RuntimeError):
+    """Raised instead of waiting when the decode pool is saturated or a scan overran its timeout"""
+
+
+def _init_worker():
+    # One core per worker process: OpenCV's own threads would only compete with the other workers
+    cv2.setNumThreads(1)
+
+
+def _scan_in_worker(image, night_mode, symbologies):
+    # Stages run one after the other: the pool's parallelism is one scan per process
+    report = {}
+    results, processed = scan_barcode(image, night_mode, report=report, symbologies=symbologies)
+    return results, None if results else preview(processed), report
+
+
+class DecodePool:
+    """
+    Worker processes shared by every session for the CPU-heavy part of a scan, so
+    night mode misses in some sessions cannot stall the reruns of the others.
+    At most max_pending scans are queued or running: past that, scan() raises
+    ScannerBusy at once, and a scan not done within timeout seconds is abandoned
+    the same way, so the tutor is told to try again instead of waiting.
+    Worker reports are replayed in SCAN_STATS and SYMBOLOGY_ORDER of this process;
+    the per-stage preprocess/decode histograms stay in the workers.
+    """
+
+    def __init__(self, processes=DECODE_PROCESSES, max_pending=None, timeout=DECODE_TIMEOUT_S):
+        self.processes = processes
+        self.max_pending = max_pending or 2 * processes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+
+    @property
+    def pending(self):
+        """Scans queued or running"""
+        with self._lock:
+            return self._pending
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking the threaded Streamlit server is not safe
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_init_worker)
+            return self._executor
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def scan(self, image, night_mode=False, report=None):
+        """
+        scan_barcode() in a worker process; raises ScannerBusy on overload, timeout or a crashed worker.
+        A worker keeps to its one core and runs the stages in turn, so there is no parallel mode.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                METRICS.count("decode_pool", result="saturé")
+                raise ScannerBusy(f"{self._pending} scans déjà en cours")
+            self._pending += 1
+
+        start = time.perf_counter()
+        executor = future = None
+        try:
+            executor = self._get_executor()
+            future = executor.submit(_scan_in_worker, image, night_mode, SYMBOLOGY_ORDER.order())
+        except RuntimeError:
+            # A broken pool, or one shut down by a concurrent reset
+            if executor is not None:
+                self._reset(executor)
+            METRICS.count("decode_pool", result="erreur")
+            raise ScannerBusy("processus de décodage redémarrés")
+        finally:
+            if future is None:
+                self._release()
+        # The slot stays taken until the worker is really done, even after a timeout
+        future.add_done_callback(self._release)
+
+        try:
+            results, processed, worker_report = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            METRICS.count("decode_pool", result="délai dépassé")
+            raise ScannerBusy(f"décodage plus long que {self.timeout:g} s")
+        except BrokenProcessPool:
+            self._reset(executor)
+            METRICS.count("decode_pool", result="erreur")
+            raise ScannerBusy("processus de décodage redémarrés")
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        METRICS.count("decode_pool", result="ok")
+        METRICS.observe("decode_pool_wait", elapsed_ms - worker_report["elapsed_ms"])
+        METRICS.observe("scan", worker_report["elapsed_ms"], result=worker_report["stage"] or "échec")
+        for stage, ms, hit in worker_report["attempts"]:
+            SCAN_STATS.record_stage(stage, ms, hit)
+        SCAN_STATS.record_scan(worker_report["source"])
+        if worker_report["source"]:
+            SYMBOLOGY_ORDER.record("datamatrix" if worker_report["source"] == "datamatrix" else "zbar")
+        if report is not None:
+            report.update(worker_report, elapsed_ms=elapsed_ms)
+        return results, processed
+
+
+class DecodeCache:
+    """
+    LRU of decode outcomes, keyed by a hash of the image bytes and the night mode,
+    bounded both in entries and in bytes of kept images. The processed image is
+    only kept for misses, which are the only ones showing it.
+    """
+
+    def __init__(self, maxsize=DECODE_CACHE_SIZE, max_bytes=DECODE_CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, results, processed, stage):
+        processed = None if results else processed
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = {"results": results, "processed": processed, "stage": stage}
+            self.nbytes += processed.nbytes if processed is not None else 0
+            while len(self._entries) > self.maxsize or (self.nbytes > self.max_bytes and len(self._entries) > 1):
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry["processed"] is not None:
+            self.nbytes -= entry["processed"].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+DECODE_CACHE = DecodeCache()
+
+
+def preview(image, max_side=PREVIEW_MAX_SIDE):
+    """Copy of a processed image small enough to show and to keep around"""
+    if image is None or max(image.shape[:2]) <= max_side:
+        return image
+    scale = max_side / max(image.shape[:2])
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def image_size(data):
+    """(width, height) read from a JPEG or PNG header without decoding; None for other formats"""
+    header = bytes(data[:24])
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+    if not header.startswith(b"\xff\xd8"):
+        return None
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:  # Markers without a length
+            pos += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):  # Start of frame
+            return (int.from_bytes(data[pos + 7:pos + 9], "big"), int.from_bytes(data[pos + 5:pos + 7], "big"))
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+    return None
+
+
+def decode_image(data, target_side=INPUT_TARGET_SIDE):
+    """
+    Grayscale image from encoded bytes (bytes, bytearray or memoryview, not copied).
+    Large photos use libjpeg's scaled decode: the biggest reduction keeping the longest
+    side at or above target_side, so no full-size colour image is ever built.
+    Returns (image, reduction); image is None if the bytes are not a readable image.
+    """
+    if len(data) == 0:
+        # cv2.imdecode raises on an empty buffer instead of returning None
+        return None, 1
+    start = time.perf_counter()
+    size = image_size(data)
+    reduction = 1
+    if size and target_side:
+        while reduction < 8 and max(size) / (reduction * 2) >= target_side:
+            reduction *= 2
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED_GRAYSCALE[reduction])
+    METRICS.observe("image_decode", (time.perf_counter() - start) * 1000, reduction=reduction)
+    return image, reduction
+
+
+def scan_image_bytes(data, night_mode=False, report=None, parallel=False, pool=None):
+    """
+    scan_barcode() on an encoded image (camera or upload bytes), memoised in DECODE_CACHE.
+    Pass a memoryview (UploadedFile.getbuffer()) to avoid copying the upload; the image
+    is decoded straight to grayscale at a reduced size, see decode_image().
+    Identical bytes, e.g. the same camera frame on a Streamlit rerun, return without
+    touching OpenCV.
+    With a DecodePool the scan itself runs in a worker process and may raise ScannerBusy;
+    parallel only applies without one, and passing both is a ValueError.
+    Returns (results, processed) like scan_barcode(), except that processed is only
+    given for a miss, shrunk to a preview(); report also gets "cache".
+    """
+    if parallel and pool is not None:
+        raise ValueError("parallel and pool are exclusive: pool workers run the stages in turn")
+    start = time.perf_counter()
+    report = {} if report is None else report
+    key = (hashlib.blake2b(data, digest_size=16).digest(), night_mode)
+    entry = DECODE_CACHE.get(key)
+    if entry is None:
+        image, reduction = decode_image(data)
+        if image is None:
+            METRICS.count("decode_cache", result="illisible")
+            report.update(stage=None, elapsed_ms=(time.perf_counter() - start) * 1000, attempts=[], cache=None)
+            return None, None
+        report["reduction"] = reduction
+        METRICS.count("decode_cache", result="miss")
+        if pool is not None:
+            results, processed = pool.scan(image, night_mode, report=report)
+        else:
+            results, processed = scan_barcode(image, night_mode, report=report, parallel=parallel)
+        processed = None if results else preview(processed)
+        report["cache"] = None
+        DECODE_CACHE.put(key, results, processed, report["stage"])
+        return results, processed
+
+    METRICS.count("decode_cache", result="exact")
+    report.update(stage=entry["stage"], elapsed_ms=(time.perf_counter() - start) * 1000, attempts=[], cache="exact")
+    return entry["results"], entry["processed"]
+
+
+class LiveScanner:
+    """
+    Decoder for a live video stream. A frame is decoded when it changed since the last
+    attempt, or every Nth frame otherwise; a code read again within the cooldown is ignored.
+    New codes go to on_code, whose return value is queued for the UI with the code.
+    """
+
+    def __init__(self, on_code=None, every_n=10, cooldown=8.0, change_threshold=3.0, night_mode=False):
+        self.on_code = on_code
+        self.every_n = every_n
+        self.cooldown = cooldown
+        self.change_threshold = change_threshold
+        self.night_mode = night_mode
+        self.results = queue.Queue()
+        self._frames = 0
+        self._last_thumb = None
+        self._seen = {}
+
+    def video_frame_callback(self, frame):
+        """streamlit-webrtc callback, runs on the video thread"""
+        self.process(frame.to_ndarray(format="gray"))
+        return frame
+
+    def process(self, gray):
+        """Feed one grayscale frame; returns the codes that were new"""
+        self._frames += 1
+        thumb = cv2.resize(gray, (32, 24), interpolation=cv2.INTER_AREA).astype(np.int16)
+        changed = self._last_thumb is None or np.abs(thumb - self._last_thumb).mean() >= self.change_threshold
+        if not changed and self._frames % self.every_n:
+            return []
+        self._last_thumb = thumb
+
+        results, _, _, _ = _run_stages(gray, self.night_mode, None, prefix="live/", stages=LIVE_STAGE_ORDER)
+        now = time.monotonic()
+        self._seen = {code: seen for code, seen in self._seen.items() if now - seen < self.cooldown}
+        new_codes = []
+        for result in results or []:
+            code = result.data.decode("utf-8")
+            if code in self._seen:
+                continue
+            self._seen[code] = now
+            new_codes.append(code)
+            try:
+                outcome = self.on_code(code) if self.on_code else None
+            except Exception as e:
+                outcome = f"❌ Erreur : {e}"
+            self.results.put((code, outcome))
+        return new_codes
+
+    def drain(self):
+        """(code, outcome) pairs produced since the last call, oldest first"""
+        items = []
+        while True:
+            try:
+                items.append(self.results.get_nowait())
+            except queue.Empty:
+                return items
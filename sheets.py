@@ -0,0 +1,195 @@
+import random
+import threading
+import time
+
+from metrics import METRICS
+from storage import is_retryable
+
+# Priority lanes, served in this order when the quota runs short
+WRITE = 0
+LOG = 1
+READ = 2
+LANE_NAMES = {WRITE: "distributions", LOG: "logs", READ: "lectures"}
+
+WRITE_METHODS = {
+    "append_row", "append_rows", "batch_clear", "batch_update", "clear", "delete_rows", "insert_row",
+    "insert_rows", "update", "update_acell", "update_cell", "update_cells",
+}
+# Not idempotent: an append that timed out may have landed, so only a 429 (certainly not applied) is retried
+APPEND_METHODS = {"append_row", "append_rows"}
+
+
+def _is_quota_error(exc):
+    return getattr(getattr(exc, "response", None), "status_code", None) == 429
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate_per_minute, holding at most `burst` tokens.
+    A caller only takes a token when no caller of a higher priority lane is waiting.
+    """
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or max(1, rate_per_minute // 6))
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = {}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _blocked_by_higher_lane(self, priority):
+        return any(count for lane, count in self._waiting.items() if lane < priority)
+
+    def acquire(self, priority=READ):
+        """Take one token, blocking as needed; returns the time spent waiting in seconds"""
+        started = time.monotonic()
+        with self._cond:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            try:
+                while True:
+                    self._refill()
+                    if self.tokens >= 1 and not self._blocked_by_higher_lane(priority):
+                        self.tokens -= 1
+                        return time.monotonic() - started
+                    wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.05
+                    self._cond.wait(max(wait, 0.01))
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+
+class SheetsQuota:
+    """
+    Budget shared by every Google Sheets call of the process: one token bucket
+    sized to the per-minute quota, jittered retries on 429/5xx, and counters.
+    """
+
+    def __init__(self, requests_per_minute=60, burst=None, max_retries=3, base_backoff=1.0, max_backoff=32.0):
+        self.bucket = TokenBucket(requests_per_minute, burst)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._counters = {lane: {"calls": 0, "throttled": 0, "retries": 0, "errors": 0, "wait_s": 0.0}
+                          for lane in LANE_NAMES}
+
+    def _count(self, priority, name, amount=1):
+        with self._lock:
+            self._counters[priority][name] += amount
+
+    def call(self, priority, func, *args, **kwargs):
+        """
+        Run one API call in the given lane, retrying retryable errors with jittered backoff.
+        Appends are only retried on 429. This is the only retry layer: callers do not loop.
+        """
+        lane = LANE_NAMES[priority]
+        method = getattr(func, "__name__", "appel")
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire(priority)
+            self._count(priority, "calls")
+            if waited > 0.01:
+                self._count(priority, "throttled")
+                self._count(priority, "wait_s", waited)
+                METRICS.observe("sheets_quota_wait", waited * 1000, lane=lane)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                METRICS.observe("sheets_call", (time.perf_counter() - start) * 1000, method=method, lane=lane)
+                return result
+            except Exception as exc:
+                retryable = is_retryable(exc) and (method not in APPEND_METHODS or _is_quota_error(exc))
+                METRICS.count("sheets_errors", method=method, retryable=retryable)
+                if attempt >= self.max_retries or not retryable:
+                    self._count(priority, "errors")
+                    raise
+                attempt += 1
+                self._count(priority, "retries")
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1))
+                time.sleep(random.uniform(backoff / 2, backoff))
+
+    def snapshot(self):
+        """One row per lane, for display in the admin pages"""
+        with self._lock:
+            return [{"File": LANE_NAMES[lane], "Appels": c["calls"], "Limités": c["throttled"],
+                     "Réessais": c["retries"], "Erreurs": c["errors"], "Attente (s)": round(c["wait_s"], 1)}
+                    for lane, c in self._counters.items()]
+
+
+class RateLimitedWorksheet:
+    """Worksheet proxy sending every method call through the quota, reads and writes in their own lanes"""
+
+    def __init__(self, worksheet, quota, write_priority=WRITE, spreadsheet=None, read_priority=READ):
+        self._worksheet = worksheet
+        self._quota = quota
+        self._write_priority = write_priority
+        self._read_priority = read_priority
+        self._spreadsheet = spreadsheet
+
+    def with_priority(self, priority):
+        """The same worksheet with every call, reads included, in the given lane"""
+        return RateLimitedWorksheet(self._worksheet, self._quota, priority, self._spreadsheet, read_priority=priority)
+
+    @property
+    def spreadsheet(self):
+        return self._spreadsheet or RateLimitedSpreadsheet(self._worksheet.spreadsheet, self._quota)
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr):
+            return attr
+        priority = self._write_priority if name in WRITE_METHODS else self._read_priority
+
+        def call(*args, **kwargs):
+            return self._quota.call(priority, attr, *args, **kwargs)
+        return call
+
+
+class RateLimitedSpreadsheet:
+    """Spreadsheet proxy; worksheets listed in `lanes` write in that lane instead of WRITE"""
+
+    def __init__(self, spreadsheet, quota, lanes=None):
+        self._spreadsheet = spreadsheet
+        self._quota = quota
+        self._lanes = lanes or {}
+
+    def _wrap(self, worksheet):
+        return RateLimitedWorksheet(worksheet, self._quota, self._lanes.get(worksheet.title, WRITE), self)
+
+    @property
+    def sheet1(self):
+        def sheet1():
+            return self._spreadsheet.sheet1
+        return self._wrap(self._quota.call(READ, sheet1))
+
+    def worksheet(self, title):
+        return self._wrap(self._quota.call(READ, self._spreadsheet.worksheet, title))
+
+    def add_worksheet(self, *args, **kwargs):
+        return self._wrap(self._quota.call(WRITE, self._spreadsheet.add_worksheet, *args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._spreadsheet, name)
+
+
+class RateLimitedClient:
+    """gspread client proxy whose spreadsheets share one SheetsQuota"""
+
+    def __init__(self, client, quota, lanes=None):
+        self._client = client
+        self.quota = quota
+        self._lanes = lanes or {}
+
+    def open(self, title):
+        return RateLimitedSpreadsheet(self._quota_call(self._client.open, title), self.quota, self._lanes)
+
+    def _quota_call(self, func, *args):
+        return self.quota.call(READ, func, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
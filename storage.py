@@ -0,0 +1,1009 @@
+import bisect
+import datetime
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+def normalize_id(numero_adherent):
+    """Canonical form of a CREM number used as index key"""
+    return str(numero_adherent).strip()
+
+
+def is_taken(value):
+    """True when a sheet cell means the poly was already handed out"""
+    try:
+        return bool(value) and bool(str(value).strip()) and int(float(value)) >= 1
+    except (TypeError, ValueError):
+        return False
+
+
+def is_retryable(exc):
+    """Quota (429) and transient server/network errors are worth retrying"""
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(exc, (ConnectionError, TimeoutError, OSError))
+
+
+def rowcol_to_a1(row, col):
+    """Convert 1-based (row, col) to an A1 cell reference"""
+    letters = ''
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return f"{letters}{row}"
+
+
+def row_from_range(updated_range):
+    """Extract the row number from an A1 range such as 'Feuille 1'!A12:F12"""
+    match = re.search(r"![A-Z]+(\d+)", updated_range or "")
+    return int(match.group(1)) if match else None
+
+
+class StudentIndex:
+    """
+    Hashed index of the student sheet: normalised CREM number -> row and poly state.
+    Built once from a get_all_values() snapshot and updated in place after each write.
+    Alongside the raw cell values, a boolean matrix (student ordinal x course) says which
+    polys are handed out, so lookups are O(1) and totals are vectorised sums.
+    """
+
+    def __init__(self, values=None):
+        self._lock = threading.RLock()
+        self.header = []
+        self.loaded_at = 0.0
+        self.refreshed_at = 0.0
+        self.version = 0
+        self._entries = {}
+        self._columns = {}
+        self._taken = np.zeros((0, 0), dtype=bool)
+        self._last_row = 1
+        if values is not None:
+            self.load(values)
+
+    @property
+    def id_field(self):
+        return self.header[0] if self.header else None
+
+    @property
+    def courses(self):
+        return self.header[1:]
+
+    def load(self, values):
+        """(Re)build the index from the raw sheet values, header row included"""
+        header = list(values[0]) if values else []
+        columns = {}
+        for col, course in enumerate(header[1:], start=2):
+            columns.setdefault(course, col)
+        entries = {}
+        taken = np.zeros((max(len(values) - 1, 0), len(header[1:])), dtype=bool)
+        last_row = 1
+        for i, row in enumerate(values[1:]):
+            row_number = i + 2
+            if not row or not str(row[0]).strip():
+                continue
+            key = normalize_id(row[0])
+            ordinal = entries[key]["ordinal"] if key in entries else len(entries)
+            polys = {course: (row[j + 1] if j + 1 < len(row) else '') for j, course in enumerate(header[1:])}
+            taken[ordinal] = [is_taken(polys[course]) for course in header[1:]]
+            entries[key] = {"row": row_number, "id": row[0], "polys": polys, "ordinal": ordinal}
+            last_row = row_number
+        with self._lock:
+            self.header = header
+            self._taken = taken
+            self._columns = columns
+            self._entries = entries
+            self._last_row = max(last_row, len(values))
+            self.loaded_at = self.refreshed_at = time.time()
+            self.version += 1
+
+    def is_stale(self, ttl):
+        return time.time() - self.loaded_at > ttl
+
+    def needs_refresh(self, ttl):
+        return time.time() - self.refreshed_at > ttl
+
+    def refresh(self, sheet):
+        """
+        Pull the rows and course columns other writers appended since the last read, in
+        one batch_get: the header row, the id column and the rows below the last known one.
+        Cells edited in place above that row are not seen; only a full load() picks them
+        up. Returns False when the sheet drifted (columns or rows moved) and a full load()
+        is needed instead.
+        """
+        with self._lock:
+            start = self._last_row + 1
+            loaded_at = self.loaded_at
+            end_column = rowcol_to_a1(1, max(len(self.header), 1)).rstrip("0123456789")
+        header, ids, tail = sheet.batch_get(["1:1", "A:A", f"A{start}:{end_column}"])
+        header = list(header[0]) if header else []
+        ids = [row[0] if row else '' for row in ids]
+
+        with self._lock:
+            if self.loaded_at != loaded_at:
+                # A full load() landed meanwhile and already covers these rows
+                return True
+            if header[:len(self.header)] != self.header:
+                return False
+            for entry in self._entries.values():
+                if entry["row"] > len(ids) or normalize_id(ids[entry["row"] - 1]) != normalize_id(entry["id"]):
+                    return False
+
+            if len(header) > len(self.header) and len(ids) >= start:
+                # New columns and new rows at once: the tail range was too narrow
+                return False
+
+            for course in header[len(self.header):]:
+                self.add_course(course)
+            for i, row in enumerate(tail):
+                if row and str(row[0]).strip():
+                    row_number = start + i
+                    self.add_student(row[0], row_number)
+                    entry = self._entries[normalize_id(row[0])]
+                    for course, value in zip(self.courses, row[1:]):
+                        self._store(entry, course, value)
+            self.refreshed_at = time.time()
+            return True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, numero_adherent):
+        return normalize_id(numero_adherent) in self._entries
+
+    def find_row(self, numero_adherent):
+        entry = self._entries.get(normalize_id(numero_adherent))
+        return entry["row"] if entry else None
+
+    def column(self, course):
+        """1-based sheet column of a course, None if unknown"""
+        return self._columns.get(course)
+
+    def get_poly(self, numero_adherent, course):
+        entry = self._entries.get(normalize_id(numero_adherent))
+        return entry["polys"].get(course, '') if entry else None
+
+    def has_poly(self, numero_adherent, course):
+        # Entries, columns and matrix are replaced together by load() and add_course()
+        with self._lock:
+            entry = self._entries.get(normalize_id(numero_adherent))
+            col = self._columns.get(course)
+            return entry is not None and col is not None and bool(self._taken[entry["ordinal"], col - 2])
+
+    def course_totals(self):
+        """Polys handed out per course, in column order"""
+        with self._lock:
+            totals = self._taken.sum(axis=0)
+            return {course: int(totals[col - 2]) for course, col in self._columns.items()}
+
+    def student_total(self, numero_adherent):
+        """Polys handed out to one student, all courses together"""
+        with self._lock:
+            entry = self._entries.get(normalize_id(numero_adherent))
+            return int(self._taken[entry["ordinal"]].sum()) if entry else 0
+
+    def _store(self, entry, course, value):
+        entry["polys"][course] = value
+        col = self._columns.get(course)
+        if col is not None:
+            self._taken[entry["ordinal"], col - 2] = is_taken(value)
+
+    def set_poly(self, numero_adherent, course, value):
+        """Apply a local write to the indexed state"""
+        with self._lock:
+            entry = self._entries.get(normalize_id(numero_adherent))
+            if entry is not None:
+                self._store(entry, course, value)
+                self.version += 1
+
+    def add_student(self, numero_adherent, row=None):
+        """Register a row appended to the sheet"""
+        with self._lock:
+            row = row or self._last_row + 1
+            key = normalize_id(numero_adherent)
+            ordinal = self._entries[key]["ordinal"] if key in self._entries else len(self._entries)
+            if ordinal >= len(self._taken):
+                # Grow by doubling so a run of appended students stays amortised O(1)
+                grown = np.zeros((max(2 * len(self._taken), 64), self._taken.shape[1]), dtype=bool)
+                grown[:len(self._taken)] = self._taken
+                self._taken = grown
+            self._taken[ordinal] = False
+            self._entries[key] = {
+                "row": row,
+                "id": numero_adherent,
+                "polys": {course: '' for course in self.courses},
+                "ordinal": ordinal,
+            }
+            self._last_row = max(self._last_row, row)
+            self.version += 1
+            return row
+
+    def add_course(self, course):
+        """Register a course column added to the header row"""
+        with self._lock:
+            self._taken = np.hstack([self._taken, np.zeros((len(self._taken), 1), dtype=bool)])
+            self.header.append(course)
+            self._columns.setdefault(course, len(self.header))
+            for entry in self._entries.values():
+                entry["polys"].setdefault(course, '')
+            self.version += 1
+
+    def record(self, numero_adherent):
+        """Student as a header -> value dict, like get_all_records()"""
+        entry = self._entries.get(normalize_id(numero_adherent))
+        if entry is None:
+            return None
+        return {self.id_field: entry["id"], **entry["polys"]}
+
+    def rows(self):
+        """Header and one value list per student, for DataFrame snapshots"""
+        with self._lock:
+            courses = self.courses
+            return list(self.header), [[entry["id"]] + [entry["polys"].get(course, '') for course in courses]
+                                       for entry in self._entries.values()]
+
+    def save_snapshot(self, path):
+        """Write the index to disk, rows kept in place, so it can be served offline"""
+        with self._lock:
+            values = [list(self.header)] + [[] for _ in range(self._last_row - 1)]
+            for entry in self._entries.values():
+                values[entry["row"] - 1] = [entry["id"]] + [entry["polys"].get(c, '') for c in self.courses]
+            snapshot = {"saved_at": time.time(), "values": values}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load_snapshot(self, path):
+        """Load a snapshot written by save_snapshot(); returns False if there is none"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.load(snapshot["values"])
+        with self._lock:
+            # Stale on purpose: a full reload replaces it as soon as the sheet is reachable
+            self.loaded_at = self.refreshed_at = snapshot["saved_at"]
+        return True
+
+    def search(self, term):
+        """Case-insensitive substring search on CREM numbers"""
+        term = normalize_id(term).lower()
+        with self._lock:
+            matches = [key for key in self._entries if term in key.lower()]
+        return [self.record(key) for key in matches]
+
+
+# Per-student outcomes of a bulk distribution
+GRANTED = "granted"
+ALREADY_TAKEN = "already_taken"
+UNKNOWN = "unknown"
+
+
+def grant_poly(index, ledger, numero_adherent, course, row, col, username=None):
+    """
+    Check the indexed state, then claim the distribution in the ledger, which is
+    atomic across sessions. Returns False if the student already has this poly.
+    """
+    if index.has_poly(numero_adherent, course):
+        return False
+    if ledger.claim(numero_adherent, course, row, col, username=username) is None:
+        index.set_poly(numero_adherent, course, 1)
+        return False
+    index.set_poly(numero_adherent, course, 1)
+    return True
+
+
+def grant_polys(index, ledger, numeros, course, col, username=None):
+    """
+    Validate a list of CREM numbers against the index and record every new
+    distribution in a single ledger transaction, synced as one batch_update.
+    Returns (numero, status) pairs in input order.
+    """
+    report = []
+    entries = []
+    granted = set()
+    for numero_adherent in numeros:
+        key = normalize_id(numero_adherent)
+        row = index.find_row(key)
+        if row is None:
+            status = UNKNOWN
+        elif key in granted or index.has_poly(key, course):
+            status = ALREADY_TAKEN
+        else:
+            status = GRANTED
+            granted.add(key)
+            entries.append((key, course, row, col, 1))
+        report.append((numero_adherent, status))
+    if entries:
+        claimed = ledger.claim_many(entries, username=username)
+        report = [(numero_adherent, ALREADY_TAKEN if status == GRANTED and normalize_id(numero_adherent) not in claimed
+                   else status) for numero_adherent, status in report]
+        for key in granted:
+            index.set_poly(key, course, 1)
+    return report
+
+
+class DistributionLedger:
+    """
+    Durable append-only record of distributions, the local source of truth.
+    Every write is committed with synchronous=FULL, i.e. fsync'd before returning.
+    The claims table holds one row per handed-out (student, course): claim() is the
+    compare-and-swap that every attribution goes through, shared by all sessions
+    and processes using the same file and kept across restarts.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS distributions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                numero TEXT NOT NULL,
+                course TEXT NOT NULL,
+                row INTEGER,
+                col INTEGER,
+                value TEXT NOT NULL,
+                username TEXT,
+                created_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                synced_at REAL,
+                last_error TEXT
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_distributions_status ON distributions (status, id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS claims (
+                numero TEXT NOT NULL,
+                course TEXT NOT NULL,
+                username TEXT,
+                claimed_at REAL NOT NULL,
+                PRIMARY KEY (numero, course)
+            )""")
+
+    def record(self, numero_adherent, course, row, col, value=1, username=None):
+        """Append a distribution; returns its ledger id once it is on disk"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO distributions (numero, course, row, col, value, username, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (normalize_id(numero_adherent), course, row, col, str(value), username, time.time()))
+            return cursor.lastrowid
+
+    def claim(self, numero_adherent, course, row, col, username=None):
+        """
+        Atomically claim a (student, course) pair and record its distribution.
+        Returns the ledger id, or None if it was already claimed.
+        """
+        claimed = self.claim_many([(numero_adherent, course, row, col, 1)], username=username)
+        return claimed.get(normalize_id(numero_adherent))
+
+    def claim_many(self, entries, username=None):
+        """
+        Claim (numero, course, row, col, value) entries in one transaction; only the
+        pairs not claimed yet are recorded. Returns {numero: ledger id} for those.
+        """
+        now = time.time()
+        claimed = {}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for numero, course, row, col, value in entries:
+                    numero = normalize_id(numero)
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO claims (numero, course, username, claimed_at) VALUES (?, ?, ?, ?)",
+                        (numero, course, username, now))
+                    if cursor.rowcount:
+                        claimed[numero] = self._conn.execute(
+                            "INSERT INTO distributions (numero, course, row, col, value, username, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (numero, course, row, col, str(value), username, now)).lastrowid
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def record_many(self, entries, username=None):
+        """
+        Append (numero, course, row, col, value) entries in one transaction.
+        Used for admin edits: claims follow the new values, so clearing a cell
+        lets the poly be handed out again.
+        """
+        now = time.time()
+        rows = [(normalize_id(numero), course, row, col, str(value), username, now)
+                for numero, course, row, col, value in entries]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO distributions (numero, course, row, col, value, username, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.executemany(
+                    "DELETE FROM claims WHERE numero = ? AND course = ?",
+                    [(numero, course) for numero, course, _, _, value, _, _ in rows if not is_taken(value)])
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO claims (numero, course, username, claimed_at) VALUES (?, ?, ?, ?)",
+                    [(numero, course, username, now) for numero, course, _, _, value, _, _ in rows if is_taken(value)])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def pending(self, limit=None):
+        """Entries not yet written to the sheet, oldest first"""
+        query = "SELECT * FROM distributions WHERE status = 'pending' ORDER BY id"
+        params = ()
+        if limit:
+            query += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params)]
+
+    def unsynced(self, since=None):
+        """Pending entries, plus those synced at or after `since`, oldest first"""
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(
+                "SELECT * FROM distributions WHERE status = 'pending' OR synced_at >= ? ORDER BY id",
+                (time.time() if since is None else since,))]
+
+    def mark_attempted(self, ids):
+        """Count a write of these entries about to be sent: from now on it may have reached the sheet"""
+        with self._lock:
+            self._conn.executemany("UPDATE distributions SET attempts = attempts + 1 WHERE id = ?",
+                                   [(i,) for i in ids])
+
+    def mark_synced(self, ids):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE distributions SET status = 'synced', synced_at = ? WHERE id = ?",
+                [(time.time(), i) for i in ids])
+
+    def mark_failed(self, ids, error):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE distributions SET last_error = ? WHERE id = ?",
+                [(str(error), i) for i in ids])
+
+    def mark_conflict(self, ledger_id, error):
+        """Give up on an entry that no longer matches the sheet"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE distributions SET status = 'conflict', last_error = ? WHERE id = ?",
+                (str(error), ledger_id))
+
+    def relocate(self, ledger_id, row, col):
+        with self._lock:
+            self._conn.execute("UPDATE distributions SET row = ?, col = ? WHERE id = ?", (row, col, ledger_id))
+
+    def conflicts(self, limit=100):
+        """Entries given up because they no longer matched the sheet, newest first"""
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(
+                "SELECT numero, course, username, created_at, last_error FROM distributions "
+                "WHERE status = 'conflict' ORDER BY id DESC LIMIT ?", (limit,))]
+
+    def claimed(self):
+        """(numero, course) pairs handed out through this ledger"""
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute("SELECT numero, course FROM claims")]
+
+    def release_claims(self, pairs):
+        """Forget claims on (numero, course) pairs, so these polys can be handed out again"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM claims WHERE numero = ? AND course = ?", pairs)
+
+    def counts(self):
+        """Number of entries per sync status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM distributions GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class SheetSyncWorker:
+    """
+    Background thread pushing pending ledger entries to the sheet in batches.
+    A batch covers at most max_rows distinct sheet rows, all read back in one batch_get.
+    Failed batches stay pending and are retried with exponential backoff.
+    """
+
+    def __init__(self, ledger, sheet, batch_size=500, max_rows=100, interval=2.0, max_backoff=60.0):
+        self.ledger = ledger
+        self.sheet = sheet
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.last_error = None
+        self.last_sync = None
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheet-sync", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def notify(self):
+        """Wake the worker up right after a new ledger entry"""
+        self._wake.set()
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                synced = self.sync_once()
+                backoff = 0.0
+                if synced:
+                    # More may be pending: batches stop at max_rows rows
+                    self._wake.set()
+            except Exception as e:
+                self.last_error = str(e)
+                backoff = min(self.max_backoff, backoff * 2 if backoff else 1.0)
+                time.sleep(backoff * random.uniform(0.8, 1.2))
+
+    def sync_once(self):
+        """Push one batch; returns the number of entries processed"""
+        if self.sheet is None:
+            return 0
+        entries = self.ledger.pending(self.batch_size)
+        rows = set()
+        for i, entry in enumerate(entries):
+            rows.add(entry["row"])
+            if len(rows) > self.max_rows:
+                entries = entries[:i]
+                break
+        if not entries:
+            return 0
+        try:
+            writable, unchanged = self._reconcile(entries)
+            if writable:
+                self.ledger.mark_attempted([e["id"] for e in writable])
+                self.sheet.batch_update([
+                    {"range": rowcol_to_a1(e["row"], e["col"]), "values": [[_cell_value(e["value"])]]}
+                    for e in writable
+                ])
+            self.ledger.mark_synced([e["id"] for e in writable + unchanged])
+        except Exception as exc:
+            self.ledger.mark_failed([e["id"] for e in entries], exc)
+            raise
+        self.last_sync = time.time()
+        self.last_error = None
+        return len(entries)
+
+    def _read_rows(self, rows, header=False):
+        """{row: cells} for distinct row numbers, in one batch_get; with header, also returns the first row"""
+        rows = sorted(set(rows))
+        ranges = (["1:1"] if header else []) + [f"{row}:{row}" for row in rows]
+        values = [value[0] if value else [] for value in self.sheet.batch_get(ranges)] if ranges else []
+        cells = dict(zip(rows, values[1:] if header else values))
+        return (values[0], cells) if header else cells
+
+    def _reconcile(self, entries):
+        """
+        Re-resolve row and column of each entry against the live sheet, so a
+        sorted sheet or a moved student never gets the poly written on the wrong row.
+        Each cell is compared with the last write queued for it earlier in the batch,
+        or else with the sheet: an entry the cell already matches needs no write. A
+        grant on a cell filled in the sheet before any attempt to write it, e.g. a poly
+        handed out by hand while the app was offline, becomes a conflict; after an
+        attempt, the filled cell is most likely that write having landed unacknowledged.
+        Returns (entries to write, last one per cell; entries synced without a write).
+        """
+        header, sheet_rows = self._read_rows([e["row"] for e in entries], header=True)
+        id_column = None
+        located = []
+        for entry in entries:
+            if entry["course"] not in header:
+                self.ledger.mark_conflict(entry["id"], f"Cours introuvable: {entry['course']}")
+                continue
+            col = header.index(entry["course"]) + 1
+            cells = sheet_rows[entry["row"]]
+            row = entry["row"]
+            if normalize_id(cells[0] if cells else '') != entry["numero"]:
+                if id_column is None:
+                    id_column = [normalize_id(v) for v in self.sheet.col_values(1)]
+                if entry["numero"] not in id_column:
+                    self.ledger.mark_conflict(entry["id"], f"Étudiant introuvable: {entry['numero']}")
+                    continue
+                row = id_column.index(entry["numero"]) + 1
+            located.append((entry, row, col))
+
+        # Moved students: read their new rows in one more call
+        sheet_rows.update(self._read_rows([row for _, row, _ in located if row not in sheet_rows]))
+
+        writes = {}
+        unchanged = []
+        for entry, row, col in located:
+            if (row, col) != (entry["row"], entry["col"]):
+                self.ledger.relocate(entry["id"], row, col)
+                entry["row"], entry["col"] = row, col
+            queued = writes.get((row, col))
+            if queued is not None:
+                current = queued["value"]
+            else:
+                cells = sheet_rows[row]
+                current = cells[col - 1] if col <= len(cells) else ''
+            if is_taken(current) != is_taken(entry["value"]):
+                if queued is not None:
+                    unchanged.append(queued)  # Overwritten within the batch: only the last value is sent
+                writes[(row, col)] = entry
+            elif queued is None and is_taken(current) and not entry["attempts"]:
+                self.ledger.mark_conflict(entry["id"], "Déjà attribué dans la feuille")
+            else:
+                unchanged.append(entry)
+        return list(writes.values()), unchanged
+
+
+class LogShipper:
+    """
+    Process-wide buffer of activity log rows, shipped with a single append_rows call
+    per flush once max_batch rows are waiting or max_delay seconds have passed.
+    Buffered rows are mirrored in a spill file so a restart does not lose them.
+    A failed flush keeps the rows for the next one; retries within a call are left
+    to the rate-limited sheet proxy.
+    """
+
+    def __init__(self, log_sheet, spill_path, max_batch=20, max_delay=5.0):
+        self.log_sheet = log_sheet
+        self.spill_path = spill_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._buffer = self._read_spill()
+        self._thread = threading.Thread(target=self._run, name="log-shipper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add(self, entry):
+        """Buffer one log row; it is on disk when this returns"""
+        with self._lock:
+            self._buffer.append(list(entry))
+            with open(self.spill_path, "a", encoding="utf-8") as spill:
+                spill.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                spill.flush()
+                os.fsync(spill.fileno())
+            if len(self._buffer) >= self.max_batch:
+                self._wake.set()
+
+    def notify(self):
+        """Ask for a flush without waiting for it"""
+        self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Ship buffered rows; returns how many were appended to the sheet"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._buffer)
+            if not batch or self.log_sheet is None:
+                return 0
+            try:
+                self.log_sheet.append_rows(batch)
+            except Exception as e:
+                self.last_error = str(e)
+                return 0
+            with self._lock:
+                del self._buffer[:len(batch)]
+                self._write_spill()
+            self.last_error = None
+            return len(batch)
+
+    def _read_spill(self):
+        directory = os.path.dirname(self.spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.spill_path):
+            return []
+        entries = []
+        with open(self.spill_path, encoding="utf-8") as spill:
+            for line in spill:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass  # Torn last line after a crash
+        return entries
+
+    def _write_spill(self):
+        tmp_path = self.spill_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as spill:
+            for entry in self._buffer:
+                spill.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            spill.flush()
+            os.fsync(spill.fileno())
+        os.replace(tmp_path, self.spill_path)
+
+
+class LogStore:
+    """
+    In-memory copy of the Logs worksheet with parsed timestamps and indexes on
+    date, user and action. sync() only fetches the rows appended since the last read,
+    and reloads everything when the sheet no longer starts with the rows it holds.
+    """
+
+    def __init__(self, columns=6):
+        self.columns = columns
+        self.header = []
+        self.rows = []
+        self.timestamps = []
+        self.synced_at = 0.0
+        self._lock = threading.RLock()
+        self._by_date = {}
+        self._by_user = {}
+        self._by_action = {}
+        self._dates = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def is_stale(self, ttl):
+        return time.time() - self.synced_at > ttl
+
+    def sync(self, log_sheet, full=False):
+        """
+        Read the rows added to the sheet since the last sync; returns how many.
+        The read starts at the last known row: when the sheet does not hold it there
+        any more (cleared, trimmed or rows deleted above), or with full, the whole
+        sheet is read again. A full reload returns the number of rows read.
+        """
+        with self._lock:
+            end_column = rowcol_to_a1(1, self.columns).rstrip("0123456789")
+            if self.header and not full:
+                last = len(self.rows) + 1
+                values = log_sheet.get_values(f"A{last}:{end_column}")
+                known = self.rows[-1] if self.rows else self.header
+                if values and _trim_row(values[0]) == _trim_row(known):
+                    self.extend(values[1:])
+                    self.synced_at = time.time()
+                    return len(values) - 1
+            values = log_sheet.get_values(f"A1:{end_column}")
+            self._clear()
+            if values:
+                self.header, values = list(values[0]), values[1:]
+            self.extend(values)
+            self.synced_at = time.time()
+            return len(values)
+
+    def _clear(self):
+        self.header = []
+        self.rows = []
+        self.timestamps = []
+        self._by_date = {}
+        self._by_user = {}
+        self._by_action = {}
+        self._dates = []
+
+    def extend(self, values):
+        """Index new rows (Date, Heure, Utilisateur, Action, Détails, Statut)"""
+        with self._lock:
+            for row in values:
+                row = list(row) + [''] * (self.columns - len(row))
+                row_id = len(self.rows)
+                self.rows.append(row)
+                self.timestamps.append(_parse_log_time(row[0], row[1]))
+                self._by_user.setdefault(row[2], []).append(row_id)
+                self._by_action.setdefault(row[3], []).append(row_id)
+                if self.timestamps[-1] is not None:
+                    day = self.timestamps[-1].date()
+                    if day not in self._by_date:
+                        self._by_date[day] = []
+                        bisect.insort(self._dates, day)
+                    self._by_date[day].append(row_id)
+
+    def users(self):
+        return sorted(self._by_user)
+
+    def actions(self):
+        return sorted(self._by_action)
+
+    def date_bounds(self):
+        """First and last day with activity, or (None, None)"""
+        with self._lock:
+            return (self._dates[0], self._dates[-1]) if self._dates else (None, None)
+
+    def query(self, user=None, action=None, date_from=None, date_to=None, offset=0, limit=None):
+        """Matching rows, newest first; returns (total, rows of the requested page)"""
+        with self._lock:
+            candidates = None
+            if user is not None:
+                candidates = set(self._by_user.get(user, ()))
+            if action is not None:
+                ids = self._by_action.get(action, ())
+                candidates = set(ids) if candidates is None else candidates.intersection(ids)
+            if date_from is not None or date_to is not None:
+                lo = bisect.bisect_left(self._dates, date_from) if date_from else 0
+                hi = bisect.bisect_right(self._dates, date_to) if date_to else len(self._dates)
+                ids = {row_id for day in self._dates[lo:hi] for row_id in self._by_date[day]}
+                candidates = ids if candidates is None else candidates & ids
+
+            if candidates is None:
+                ids = range(len(self.rows) - 1, -1, -1)
+            else:
+                ids = sorted(candidates, reverse=True)
+            page = ids[offset:offset + limit] if limit else ids[offset:]
+            return len(ids), [self.rows[i] for i in page]
+
+    def values(self):
+        """Header and rows, like get_all_values()"""
+        with self._lock:
+            return [list(self.header)] + [list(row) for row in self.rows] if self.header else []
+
+
+def _trim_row(row):
+    """Row as the API returns it: text cells, trailing empty ones dropped"""
+    row = [str(value) for value in row]
+    while row and row[-1] == '':
+        row.pop()
+    return row
+
+
+def _parse_log_time(date_str, time_str):
+    try:
+        return datetime.datetime.strptime(f"{date_str} {time_str}", "%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        try:
+            return datetime.datetime.strptime(date_str, "%d/%m/%Y")
+        except ValueError:
+            return None
+
+
+def _cell_value(value):
+    """Ledger values are stored as text; write numbers back as numbers"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class SheetsUnavailable(ConnectionError):
+    """Google Sheets cannot be reached; the app runs from its local copies"""
+
+
+class DataService:
+    """
+    Everything the app shares between sessions: worksheet handles, the local
+    stores built from them and the background writers feeding them back.
+
+    The service works offline first: `connect` (returning the student and log
+    worksheets) is retried in the background until it succeeds, the student index
+    is served from its last snapshot on disk, and the ledger and log spill file
+    queue writes until the sheet is back. `sync_view` maps the student worksheet
+    to the handle the sync worker reads and writes through. Once online, the same
+    background thread re-downloads the student sheet every `student_reload_interval`
+    seconds, so edits made in place by other writers reach the index without a
+    request paying for the download.
+    """
+
+    def __init__(self, connect, data_dir, log_columns=6, retry_interval=15.0, sync_view=None,
+                 student_reload_interval=1800.0):
+        self._connect = connect
+        self._sync_view = sync_view or (lambda sheet: sheet)
+        self._sheet = None
+        self._log_sheet = None
+        self.online = False
+        self.last_error = None
+        self.retry_interval = retry_interval
+        self.student_reload_interval = student_reload_interval
+        self.snapshot_path = os.path.join(data_dir, "students_snapshot.json")
+        self.students = StudentIndex()
+        self.logs = LogStore(columns=log_columns)
+        self.ledger = DistributionLedger(os.path.join(data_dir, "distributions.sqlite3"))
+        self.sync_worker = SheetSyncWorker(self.ledger, None)
+        self.log_shipper = LogShipper(None, os.path.join(data_dir, "pending_logs.jsonl"))
+        self._thread = threading.Thread(target=self._run, name="sheets-connect", daemon=True)
+
+    @property
+    def sheet(self):
+        if self._sheet is None or not self.online:
+            raise SheetsUnavailable(f"Google Sheets injoignable: {self.last_error}")
+        return self._sheet
+
+    @property
+    def log_sheet(self):
+        if self._log_sheet is None or not self.online:
+            raise SheetsUnavailable(f"Google Sheets injoignable: {self.last_error}")
+        return self._log_sheet
+
+    @property
+    def spreadsheet(self):
+        return self.sheet.spreadsheet
+
+    def start(self):
+        self.sync_worker.start()
+        self.log_shipper.start()
+        self.connect()
+        self._thread.start()
+        return self
+
+    def connect(self):
+        """Open (or probe) the worksheets; returns True once online"""
+        try:
+            if self._sheet is None:
+                sheet, log_sheet = self._connect()
+                self.sync_worker.sheet, self.log_shipper.log_sheet = self._sync_view(sheet), log_sheet
+                self._sheet, self._log_sheet = sheet, log_sheet
+            else:
+                self._sheet.row_values(1)
+        except Exception as e:
+            self.report_failure(e)
+            return False
+        self.online = True
+        self.last_error = None
+        self.sync_worker.notify()
+        self.log_shipper.notify()
+        return True
+
+    def report_failure(self, exc):
+        """Switch to offline mode after a network or API outage"""
+        if self._sheet is None or is_retryable(exc):
+            self.online = False
+            self.last_error = str(exc)
+
+    def reload_students(self):
+        """Full download of the student sheet into the index, keeping the local writes it may miss"""
+        downloaded_at = time.time()
+        values = self.sheet.get_all_values()
+        if values:
+            self.students.load(values)
+            # Distributions not yet synced are missing from the download
+            self.restore_local_writes(self.students, since=downloaded_at)
+            self.students.save_snapshot(self.snapshot_path)
+        return bool(values)
+
+    def _run(self):
+        while True:
+            time.sleep(self.retry_interval * random.uniform(0.8, 1.2))
+            if not self.online:
+                self.connect()
+            elif self.students.loaded_at and self.students.is_stale(self.student_reload_interval):
+                try:
+                    self.reload_students()
+                except Exception as e:
+                    self.report_failure(e)
+
+    def restore_local_writes(self, index, since=None):
+        """
+        Re-apply the ledger entries the loaded values may not show yet: pending ones, and
+        with `since` (when a full download of the sheet started) those synced meanwhile.
+        After such a download, claims whose cell is empty in the sheet are released:
+        the cell was cleared there, and the poly can be handed out again.
+        """
+        replayed = set()
+        for entry in self.ledger.unsynced(since):
+            index.set_poly(entry["numero"], entry["course"], entry["value"])
+            replayed.add((entry["numero"], entry["course"]))
+        if since is not None:
+            released = [(numero, course) for numero, course in self.ledger.claimed()
+                        if (numero, course) not in replayed and not index.has_poly(numero, course)]
+            if released:
+                self.ledger.release_claims(released)
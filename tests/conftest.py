@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_sheets import FakeSpreadsheet  # noqa: E402
+from storage import DataService  # noqa: E402
+
+STUDENTS = [
+    ["Numéro", "UE1", "UE2"],
+    ["101", "", ""],
+    ["102", "1", ""],
+    ["103", "", "1"],
+]
+LOG_HEADER = ["Date", "Heure", "Utilisateur", "Action", "Détails", "Statut"]
+
+
+@pytest.fixture
+def make_service(tmp_path):
+    """Factory of (FakeSpreadsheet, DataService) pairs, online and loaded; services share the data directory"""
+
+    def make(values=STUDENTS):
+        spreadsheet = FakeSpreadsheet({"Sheet1": values, "Logs": [LOG_HEADER]})
+        service = DataService(lambda: (spreadsheet.sheet1, spreadsheet.worksheet("Logs")), str(tmp_path))
+        assert service.connect()
+        service.students.load(service.sheet.get_all_values())
+        return spreadsheet, service
+
+    return make
@@ -0,0 +1,76 @@
+import pytest
+
+from backends import MemoryBackend, QuotaExceeded, SheetsBackend, SQLiteBackend, StorageBackend
+from conftest import STUDENTS
+from fake_sheets import FakeSpreadsheet
+from storage import ALREADY_TAKEN, GRANTED, UNKNOWN
+
+
+@pytest.fixture(params=["memory", "sqlite", "sheets"])
+def backend(request, tmp_path, make_service):
+    if request.param == "memory":
+        backend = MemoryBackend()
+    elif request.param == "sqlite":
+        backend = SQLiteBackend(str(tmp_path / "polys.sqlite3"))
+    else:
+        backend = SheetsBackend(make_service()[1])
+    backend.load(STUDENTS)
+    return backend
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_grant(backend):
+    assert backend.grant("101", "UE1", username="tuteur") == GRANTED
+    assert backend.grant("101", "UE1", username="tuteur") == ALREADY_TAKEN
+    assert backend.grant("102", "UE1") == ALREADY_TAKEN
+    assert backend.grant("999", "UE1") == UNKNOWN
+    assert backend.grant("101", "UE9") == UNKNOWN
+    assert backend.has_poly("101", "UE1")
+
+
+def test_grant_many_keeps_input_order(backend):
+    report = backend.grant_many(["103", "999", "101", "101"], "UE1")
+    assert report == [("103", GRANTED), ("999", UNKNOWN), ("101", GRANTED), ("101", ALREADY_TAKEN)]
+    assert backend.course_counts()["UE1"] == 3
+
+
+def test_set_many(backend):
+    backend.set_many([("101", "UE2", "1"), ("103", "UE2", ""), ("999", "UE2", "1"), ("101", "UE9", "1")],
+                     username="admin")
+    assert backend.has_poly("101", "UE2")
+    assert not backend.has_poly("103", "UE2")
+    assert not backend.find_student("999")
+    assert backend.course_counts() == {"UE1": 1, "UE2": 1}
+    # A cleared cell can be handed out again
+    assert backend.grant("103", "UE2") == GRANTED
+
+
+def test_sheets_backend_syncs_to_sheet(make_service):
+    spreadsheet, service = make_service()
+    backend = SheetsBackend(service)
+    assert backend.grant_many(["101", "103"], "UE1") == [("101", GRANTED), ("103", GRANTED)]
+    backend.set_poly("102", "UE1", "")
+    assert service.sync_worker.sync_once() == 3
+    assert spreadsheet.sheet1.get_all_values() == [STUDENTS[0], ["101", "1"], ["102"], ["103", "1", "1"]]
+    assert service.ledger.counts() == {"synced": 3}
+
+
+@pytest.mark.parametrize("make_fake, call", [
+    (MemoryBackend, lambda fake: fake.courses()),
+    (FakeSpreadsheet, lambda fake: fake.worksheet("Sheet1")),
+])
+def test_fakes_simulate_quota_errors(make_fake, call):
+    fake = make_fake(quota_error_rate=0.5, seed=1)
+    failures = 0
+    for _ in range(200):
+        try:
+            call(fake)
+        except QuotaExceeded as e:
+            assert e.response.status_code == 429
+            failures += 1
+    assert failures == fake.quota_errors
+    assert 60 < failures < 140
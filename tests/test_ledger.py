@@ -0,0 +1,54 @@
+import threading
+import time
+
+from backends import SheetsBackend
+from storage import ALREADY_TAKEN, GRANTED, DistributionLedger
+
+
+def test_claim_is_compare_and_swap(tmp_path):
+    ledger = DistributionLedger(str(tmp_path / "ledger.sqlite3"))
+    first = ledger.claim("101", "UE1", 2, 2, username="a")
+    assert first is not None
+    assert ledger.claim(" 101 ", "UE1", 2, 2, username="b") is None
+    assert ledger.claim_many([("101", "UE1", 2, 2, 1), ("102", "UE1", 3, 2, 1)]) == {"102": first + 1}
+    assert sorted(ledger.claimed()) == [("101", "UE1"), ("102", "UE1")]
+
+
+def test_claims_race(make_service):
+    _, service = make_service()
+    backend = SheetsBackend(service)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(backend.grant("101", "UE2"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [ALREADY_TAKEN] * 7 + [GRANTED]
+    assert len(service.ledger.pending()) == 1
+
+
+def test_claims_survive_restart(make_service):
+    _, service = make_service()
+    assert SheetsBackend(service).grant("101", "UE1") == GRANTED
+    # Another process sharing the data directory, with an index loaded before the grant
+    _, other = make_service()
+    assert SheetsBackend(other).grant("101", "UE1") == ALREADY_TAKEN
+
+
+def test_cleared_cell_releases_claim(make_service):
+    spreadsheet, service = make_service()
+    backend = SheetsBackend(service)
+    assert backend.grant("101", "UE1") == GRANTED
+    assert backend.grant("103", "UE1") == GRANTED
+    service.sync_worker.sync_once()
+    assert backend.grant("102", "UE2") == GRANTED
+    spreadsheet.sheet1.update_cell(2, 2, "")
+
+    downloaded_at = time.time()
+    service.students.load(spreadsheet.sheet1.get_all_values())
+    service.restore_local_writes(service.students, since=downloaded_at)
+    assert not service.students.has_poly("101", "UE1")
+    assert backend.grant("101", "UE1") == GRANTED
+    # Still in the sheet, or not synced yet: kept
+    assert backend.grant("103", "UE1") == ALREADY_TAKEN
+    assert backend.grant("102", "UE2") == ALREADY_TAKEN
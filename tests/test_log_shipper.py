@@ -0,0 +1,47 @@
+from conftest import LOG_HEADER
+from fake_sheets import FakeSpreadsheet
+from storage import LogShipper
+
+
+def log_row(user):
+    return ["01/01/2025", "10:00:00", user, "Connexion", "", "Succès"]
+
+
+def test_flush_ships_one_batch(tmp_path):
+    spreadsheet = FakeSpreadsheet({"Logs": [LOG_HEADER]})
+    shipper = LogShipper(spreadsheet.worksheet("Logs"), str(tmp_path / "pending_logs.jsonl"))
+    for user in ["alice", "bob"]:
+        shipper.add(log_row(user))
+    calls = spreadsheet.calls
+    assert shipper.flush() == 2 and shipper.flush() == 0
+    assert spreadsheet.calls == calls + 1
+    assert spreadsheet.worksheet("Logs").get_all_values()[1:] == [log_row("alice"), log_row("bob")]
+    assert shipper.pending() == 0 and (tmp_path / "pending_logs.jsonl").read_text() == ""
+
+
+def test_failed_flush_keeps_the_rows(tmp_path):
+    spreadsheet = FakeSpreadsheet({"Logs": [LOG_HEADER]})
+    log_sheet = spreadsheet.worksheet("Logs")
+    shipper = LogShipper(log_sheet, str(tmp_path / "pending_logs.jsonl"))
+    shipper.add(log_row("alice"))
+    spreadsheet.online = False
+    assert shipper.flush() == 0
+    assert shipper.pending() == 1 and "injoignable" in shipper.last_error
+    spreadsheet.online = True
+    assert shipper.flush() == 1 and shipper.last_error is None
+    assert log_sheet.get_all_values()[1:] == [log_row("alice")]
+
+
+def test_spill_file_survives_a_restart(tmp_path):
+    spill_path = str(tmp_path / "logs" / "pending_logs.jsonl")
+    shipper = LogShipper(None, spill_path)
+    shipper.add(log_row("élodie"))
+    shipper.add(log_row("bob"))
+    with open(spill_path, "a", encoding="utf-8") as spill:
+        spill.write('["01/01/2025", "10:0')  # Torn write of a crashed process
+
+    spreadsheet = FakeSpreadsheet({"Logs": [LOG_HEADER]})
+    restarted = LogShipper(spreadsheet.worksheet("Logs"), spill_path)
+    assert restarted.pending() == 2
+    assert restarted.flush() == 2
+    assert spreadsheet.worksheet("Logs").get_all_values()[1:] == [log_row("élodie"), log_row("bob")]
@@ -0,0 +1,63 @@
+import datetime
+
+from conftest import LOG_HEADER
+from fake_sheets import FakeSpreadsheet
+from storage import LogStore
+
+
+def log_row(day, user, action, status="Succès"):
+    return [f"{day:02d}/01/2025", "10:00:00", user, action, "", status]
+
+
+def make_log_sheet(rows):
+    return FakeSpreadsheet({"Logs": [LOG_HEADER] + rows}).worksheet("Logs")
+
+
+def test_incremental_sync_and_query():
+    sheet = make_log_sheet([log_row(1, "alice", "Connexion"), log_row(2, "bob", "Enregistrement poly")])
+    store = LogStore()
+    assert store.sync(sheet) == 2
+    sheet.append_rows([log_row(3, "alice", "Enregistrement poly", "Échec")])
+    assert store.sync(sheet) == 1
+    assert store.sync(sheet) == 0
+
+    assert store.users() == ["alice", "bob"]
+    assert store.date_bounds() == (datetime.date(2025, 1, 1), datetime.date(2025, 1, 3))
+    total, rows = store.query(user="alice")
+    assert total == 2 and [row[0] for row in rows] == ["03/01/2025", "01/01/2025"]
+    total, rows = store.query(action="Enregistrement poly", date_to=datetime.date(2025, 1, 2))
+    assert total == 1 and rows[0][2] == "bob"
+    total, rows = store.query(offset=1, limit=1)
+    assert total == 3 and rows[0][2] == "bob"
+
+
+def test_cleared_sheet_reloads():
+    sheet = make_log_sheet([log_row(1, "alice", "Connexion"), log_row(2, "bob", "Connexion")])
+    store = LogStore()
+    store.sync(sheet)
+    # Cleared down to the header, then new activity
+    sheet.spreadsheet.worksheet("Logs")._values[1:] = []
+    sheet.append_rows([log_row(5, "carol", "Connexion")])
+    assert store.sync(sheet) == 1
+    assert len(store) == 1 and store.users() == ["carol"]
+    assert store.date_bounds() == (datetime.date(2025, 1, 5),) * 2
+
+
+def test_rows_deleted_above_reload():
+    sheet = make_log_sheet([log_row(day, "alice", "Connexion") for day in range(1, 5)])
+    store = LogStore()
+    store.sync(sheet)
+    sheet.spreadsheet.worksheet("Logs")._values[1:3] = []
+    sheet.append_rows([log_row(9, "bob", "Connexion")])
+    store.sync(sheet)
+    assert [row[0][:2] for row in store.values()[1:]] == ["03", "04", "09"]
+
+
+def test_full_sync():
+    sheet = make_log_sheet([log_row(1, "alice", "Connexion"), log_row(2, "bob", "Connexion")])
+    store = LogStore()
+    store.sync(sheet)
+    # Edited above the last row: invisible to an incremental sync
+    sheet.update("C2", [["alicia"]])
+    assert store.sync(sheet) == 0 and store.users() == ["alice", "bob"]
+    assert store.sync(sheet, full=True) == 2 and store.users() == ["alicia", "bob"]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from metrics import BUCKETS_MS, Metrics
+
+
+def test_span_times_the_block_even_on_error():
+    metrics = Metrics()
+    with metrics.span("scan", user="alice"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.span("scan", user="alice"):
+            raise ValueError
+    row, = metrics.snapshot()
+    assert (row["Mesure"], row["Étiquettes"], row["Nombre"]) == ("scan", "user=alice", 2)
+
+
+def test_labels_split_series_in_any_order():
+    metrics = Metrics()
+    metrics.count("decode_cache", result="miss")
+    metrics.count("decode_cache", result="exact", amount=3)
+    metrics.count("grant", user="a", course="UE1")
+    metrics.count("grant", course="UE1", user="a")
+    assert metrics.counters() == [
+        {"Compteur": "decode_cache", "Étiquettes": "result=exact", "Valeur": 3},
+        {"Compteur": "decode_cache", "Étiquettes": "result=miss", "Valeur": 1},
+        {"Compteur": "grant", "Étiquettes": "course=UE1, user=a", "Valeur": 2},
+    ]
+
+
+def test_percentiles_and_buckets():
+    metrics = Metrics()
+    for ms in range(1, 101):
+        metrics.observe("sync", ms)
+    histogram, = json.loads(metrics.to_json())["histograms"]
+    assert histogram["count"] == 100 and histogram["max_ms"] == 100
+    assert histogram["p50_ms"] == pytest.approx(50.5)
+    # Bucket bounds are inclusive, like Prometheus "le"
+    assert histogram["buckets"]["5"] == 3 and histogram["buckets"]["100"] == 50
+    assert sum(histogram["buckets"].values()) == 100 and len(histogram["buckets"]) == len(BUCKETS_MS) + 1
+
+
+def test_prometheus_exposition():
+    metrics = Metrics()
+    metrics.observe("scan", 4, stage='roi/"base"')
+    metrics.observe("scan", 40000, stage='roi/"base"')
+    metrics.count("grant", result="granted")
+    lines = metrics.to_prometheus().splitlines()
+    assert "# TYPE crem_scan_seconds histogram" in lines
+    assert 'crem_scan_seconds_bucket{stage="roi/\\"base\\"",le="0.005"} 1' in lines
+    assert 'crem_scan_seconds_bucket{stage="roi/\\"base\\"",le="+Inf"} 2' in lines
+    assert 'crem_scan_seconds_sum{stage="roi/\\"base\\""} 40.004' in lines
+    assert 'crem_scan_seconds_count{stage="roi/\\"base\\""} 2' in lines
+    assert lines[-2:] == ["# TYPE crem_grant_total counter", 'crem_grant_total{result="granted"} 1']
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from backends import SheetsBackend
+from storage import ALREADY_TAKEN, GRANTED
+
+
+def reload(spreadsheet, service):
+    """Full download of the sheet, like load_student_index() after STUDENT_FULL_RELOAD_TTL"""
+    downloaded_at = time.time()
+    service.students.load(spreadsheet.sheet1.get_all_values())
+    service.restore_local_writes(service.students, since=downloaded_at)
+
+
+def test_offline_grants_are_replayed_after_reload(make_service):
+    spreadsheet, service = make_service()
+    backend = SheetsBackend(service)
+    spreadsheet.online = False
+    assert backend.grant("101", "UE2") == GRANTED
+    with pytest.raises(Exception):
+        service.sync_worker.sync_once()
+
+    # A full reload from a sheet that does not show the grant yet keeps it
+    spreadsheet.online = True
+    reload(spreadsheet, service)
+    assert service.students.has_poly("101", "UE2")
+    assert backend.grant("101", "UE2") == ALREADY_TAKEN
+
+    assert service.sync_worker.sync_once() == 1
+    assert spreadsheet.sheet1.row_values(2) == ["101", "", "1"]
+
+
+def test_cell_filled_in_sheet_is_a_conflict(make_service):
+    spreadsheet, service = make_service()
+    backend = SheetsBackend(service)
+    assert backend.grant("101", "UE2", username="tuteur") == GRANTED
+    # Handed out by hand before the sync, and a row was inserted above
+    sheet = spreadsheet.sheet1
+    sheet.update("A2:C5", [["100", "", ""], ["101", "", "1"], ["102", "1", ""], ["103", "", "1"]])
+    assert backend.grant("103", "UE1") == GRANTED
+
+    assert service.sync_worker.sync_once() == 2
+    assert [entry["numero"] for entry in service.ledger.conflicts()] == ["101"]
+    assert sheet.row_values(5) == ["103", "1", "1"]
+
+
+def test_regrant_after_admin_clear_in_one_batch(make_service):
+    spreadsheet, service = make_service()
+    backend = SheetsBackend(service)
+    assert backend.grant("101", "UE1") == GRANTED
+    service.sync_worker.sync_once()
+    backend.set_poly("101", "UE1", "", username="admin")
+    assert backend.grant("101", "UE1") == GRANTED
+
+    assert service.sync_worker.sync_once() == 2
+    assert service.ledger.conflicts() == []
+    assert spreadsheet.sheet1.row_values(2) == ["101", "1"]
+    assert service.students.has_poly("101", "UE1")
+
+
+def test_unacknowledged_write_is_not_a_conflict(make_service, monkeypatch):
+    spreadsheet, service = make_service()
+    assert SheetsBackend(service).grant_many(["101", "103"], "UE1") == [("101", GRANTED), ("103", GRANTED)]
+
+    def crash(ids):
+        raise RuntimeError("crash")
+
+    # batch_update lands, but the process dies before the ledger hears about it
+    with monkeypatch.context() as patch:
+        patch.setattr(service.ledger, "mark_synced", crash)
+        with pytest.raises(RuntimeError):
+            service.sync_worker.sync_once()
+
+    updates = []
+    monkeypatch.setattr(spreadsheet.sheet1, "batch_update", updates.append)
+    assert service.sync_worker.sync_once() == 2
+    assert updates == []
+    assert service.ledger.conflicts() == []
+    assert service.ledger.counts() == {"synced": 2}
+
+
+def test_sync_reads_each_row_once_and_caps_rows(make_service, monkeypatch):
+    spreadsheet, service = make_service([["Numéro", "UE1", "UE2"]] + [[str(100 + i)] for i in range(1, 11)])
+    backend = SheetsBackend(service)
+    for course in ("UE1", "UE2"):
+        backend.grant_many([str(100 + i) for i in range(1, 11)], course)
+
+    sheet = spreadsheet.sheet1
+    batch_get = sheet.batch_get
+    reads = []
+    monkeypatch.setattr(sheet, "batch_get", lambda ranges: reads.append(ranges) or batch_get(ranges))
+    service.sync_worker.max_rows = 4
+
+    assert service.sync_worker.sync_once() == 4
+    assert reads == [["1:1", "2:2", "3:3", "4:4", "5:5"]]
+    while service.sync_worker.sync_once():
+        pass
+    assert all(len(ranges) <= 5 for ranges in reads)
+    assert sheet.get_all_values()[1:] == [[str(100 + i), "1", "1"] for i in range(1, 11)]
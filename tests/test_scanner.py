@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+import scanner
+from scanner import CHEAP_STAGES, HEAVY_STAGES, scan_barcode
+
+
+def qr_card(text="12345", size=(1200, 1600), at=(700, 900), module=8):
+    """Grayscale photo-like image with a QR code whose top-left quiet zone corner is at `at` (y, x)"""
+    code = cv2.QRCodeEncoder.create().encode(text)
+    code = cv2.resize(code, None, fx=module, fy=module, interpolation=cv2.INTER_NEAREST)
+    image = np.full(size, 255, np.uint8)
+    image[at[0]:at[0] + code.shape[0], at[1]:at[1] + code.shape[1]] = code
+    return image
+
+
+@pytest.mark.parametrize("use_roi", [True, False])
+def test_rect_in_scanned_image_coordinates(use_roi):
+    report = {}
+    results, _ = scan_barcode(qr_card(), report=report, use_roi=use_roi, symbologies=["zbar"])
+    assert [r.data for r in results] == [b"12345"]
+    left, top, width, height = results[0].rect
+    # The code starts after the 2-module quiet zone, 16 px from the corner
+    assert abs(left - 916) <= 4 and abs(top - 716) <= 4
+    assert abs(width - 168) <= 8 and abs(height - 168) <= 8
+
+
+def test_datamatrix_runs_before_heavy_zbar_stages(monkeypatch):
+    monkeypatch.setattr(scanner, "dmtx_decode", lambda image, timeout, max_count: [])
+    report = {}
+    results, _ = scan_barcode(np.full((300, 400), 255, np.uint8), report=report, use_roi=False,
+                              symbologies=["zbar", "datamatrix"])
+    assert results is None
+    # A small frame has no downscaled stage
+    assert [stage for stage, _, _ in report["attempts"]] == CHEAP_STAGES[1:] + ["datamatrix"] + HEAVY_STAGES
+
+
+def test_datamatrix_rect_in_scanned_image_coordinates(monkeypatch):
+    found = SimpleNamespace(data=b"67890", rect=SimpleNamespace(left=10, top=20, width=30, height=30))
+    monkeypatch.setattr(scanner, "dmtx_decode", lambda image, timeout, max_count: [found])
+    image = np.full((2 * scanner.DMTX_MAX_SIDE * 3 // 4, 2 * scanner.DMTX_MAX_SIDE), 255, np.uint8)
+    results, _ = scan_barcode(image, use_roi=False, symbologies=["datamatrix"])
+    # Decoded at half size, top measured from the bottom edge
+    assert results == [scanner.DecodedCode(b"67890", "DATAMATRIX", (20, image.shape[0] - 100, 60, 60))]
+
+
+@pytest.fixture
+def decode_cache():
+    scanner.DECODE_CACHE.clear()
+    yield scanner.DECODE_CACHE
+    scanner.DECODE_CACHE.clear()
+
+
+def test_repeated_bytes_hit_the_cache(decode_cache):
+    data = cv2.imencode(".png", qr_card())[1].tobytes()
+    first, second = {}, {}
+    assert scanner.scan_image_bytes(data, report=first)[0][0].data == b"12345"
+    assert scanner.scan_image_bytes(memoryview(data), report=second)[0][0].data == b"12345"
+    assert (first["cache"], second["cache"]) == (None, "exact")
+    assert len(decode_cache) == 1
+
+
+def test_misses_keep_a_preview_only(decode_cache):
+    data = cv2.imencode(".jpg", np.full((750, 1000), 255, np.uint8))[1].tobytes()
+    results, processed = scanner.scan_image_bytes(data)
+    assert results is None
+    assert max(processed.shape) == scanner.PREVIEW_MAX_SIDE
+    assert decode_cache.nbytes == processed.nbytes
+
+
+def test_decode_cache_is_bounded_in_bytes():
+    cache = scanner.DecodeCache(maxsize=10, max_bytes=3 * 100 * 100)
+    for i in range(5):
+        cache.put(i, None, np.zeros((100, 100), np.uint8), None)
+    assert len(cache) == 3 and cache.nbytes == 3 * 100 * 100
+    assert cache.get(0) is None and cache.get(4) is not None
+    cache.put(5, [scanner.DecodedCode(b"1", "QRCODE", (0, 0, 1, 1))], np.zeros((100, 100), np.uint8), "base")
+    assert cache.get(5)["processed"] is None and cache.nbytes == 3 * 100 * 100
+
+
+def test_decode_pool_frees_the_slot_when_submit_fails():
+    pool = scanner.DecodePool(processes=1, max_pending=1)
+    executor = ThreadPoolExecutor(1)
+    executor.shutdown()
+    pool._executor = executor
+    with pytest.raises(scanner.ScannerBusy):
+        pool.scan(qr_card())
+    assert pool.pending == 0 and pool._executor is None
+
+
+def test_parallel_and_pool_are_exclusive():
+    with pytest.raises(ValueError):
+        scanner.scan_image_bytes(b"", parallel=True, pool=scanner.DecodePool(processes=1))
+
+
+@pytest.mark.parametrize("data", [b"", memoryview(b""), b"not an image"])
+def test_unreadable_upload_is_no_code(decode_cache, data):
+    report = {}
+    assert scanner.scan_image_bytes(data, report=report) == (None, None)
+    assert report["stage"] is None and report["cache"] is None
+    assert len(decode_cache) == 0
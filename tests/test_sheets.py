@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from fake_sheets import FakeSpreadsheet
+from sheets import LOG, READ, WRITE, RateLimitedSpreadsheet, SheetsQuota, TokenBucket
+
+
+class ServerError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = type("Response", (), {"status_code": status_code})()
+
+
+def failing(name, errors):
+    """API method stand-in raising `errors` in turn, then succeeding"""
+    calls = []
+
+    def method():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+
+    method.__name__ = name
+    return method, calls
+
+
+def test_token_bucket_serves_writes_first():
+    bucket = TokenBucket(600, burst=1)
+    bucket.acquire(READ)
+    order = []
+    reader = threading.Thread(target=lambda: (bucket.acquire(READ), order.append("read")))
+    writer = threading.Thread(target=lambda: (bucket.acquire(WRITE), order.append("write")))
+    reader.start()
+    time.sleep(0.02)
+    writer.start()
+    reader.join()
+    writer.join()
+    assert order == ["write", "read"]
+
+
+@pytest.mark.parametrize("name, status, attempts", [
+    ("batch_update", 429, 4),
+    ("batch_update", 503, 4),
+    ("append_rows", 429, 4),
+    ("append_rows", 503, 1),
+    ("batch_get", 400, 1),
+])
+def test_quota_retries(name, status, attempts):
+    quota = SheetsQuota(6000, max_retries=3, base_backoff=0.0)
+    method, calls = failing(name, [ServerError(status)] * 10)
+    with pytest.raises(ServerError):
+        quota.call(WRITE, method)
+    assert len(calls) == attempts
+
+
+def test_quota_recovers_after_retry():
+    quota = SheetsQuota(6000, max_retries=3, base_backoff=0.0)
+    method, calls = failing("batch_get", [ServerError(429)])
+    assert quota.call(READ, method) == "ok"
+    assert len(calls) == 2
+    assert quota.snapshot()[READ]["Réessais"] == 1
+
+
+def test_lanes():
+    quota = SheetsQuota(6000)
+    spreadsheet = RateLimitedSpreadsheet(FakeSpreadsheet({"Sheet1": [["Numéro"]], "Logs": [["Date"]]}), quota,
+                                         lanes={"Logs": LOG})
+    sheet, logs = spreadsheet.sheet1, spreadsheet.worksheet("Logs")
+    sheet.batch_get(["1:1"])
+    sheet.update_cell(2, 1, "101")
+    logs.append_rows([["01/01/2025"]])
+    # The sync worker's reads belong to the distribution write
+    sheet.with_priority(WRITE).col_values(1)
+    calls = [lane["Appels"] for lane in quota.snapshot()]
+    assert calls == [2, 1, 3]  # WRITE, LOG, READ (sheet1 and worksheet() lookups included)
@@ -0,0 +1,53 @@
+from backends import SheetsBackend
+from conftest import STUDENTS
+from storage import GRANTED, StudentIndex
+
+
+def test_refresh_pulls_appended_rows_and_courses(make_service):
+    spreadsheet, service = make_service()
+    index = service.students
+    spreadsheet.sheet1.append_rows([["104", "1", ""]])
+    assert index.refresh(spreadsheet.sheet1)
+    assert index.find_row("104") == 5 and index.has_poly("104", "UE1")
+
+    spreadsheet.sheet1.update_cell(1, 4, "UE3")
+    assert index.refresh(spreadsheet.sheet1)
+    assert index.courses == ["UE1", "UE2", "UE3"]
+    assert index.column("UE3") == 4
+
+
+def test_refresh_reports_drift(make_service):
+    spreadsheet, service = make_service()
+    # Rows moved: a full load is needed
+    spreadsheet.sheet1.update("A2", [["102"], ["101"]])
+    assert not service.students.refresh(spreadsheet.sheet1)
+
+
+def test_in_place_edits_need_a_full_reload(make_service):
+    spreadsheet, service = make_service()
+    spreadsheet.sheet1.update_cell(2, 3, "1")
+    assert service.students.refresh(spreadsheet.sheet1)
+    assert not service.students.has_poly("101", "UE2")
+    assert service.reload_students()
+    assert service.students.has_poly("101", "UE2")
+
+
+def test_reload_keeps_pending_writes(make_service):
+    spreadsheet, service = make_service()
+    assert SheetsBackend(service).grant("103", "UE1") == GRANTED
+    spreadsheet.sheet1.append_rows([["104", "", ""]])
+    service.reload_students()
+    assert service.students.has_poly("103", "UE1") and "104" in service.students
+
+
+def test_refresh_racing_a_full_load_keeps_it():
+    index = StudentIndex(STUDENTS)
+
+    class Sheet:
+        def batch_get(self, ranges):
+            # The background reload lands while this batch_get is in flight
+            index.load(STUDENTS[:2])
+            return [[STUDENTS[0]], [[row[0]] for row in STUDENTS], []]
+
+    assert index.refresh(Sheet())
+    assert len(index) == 1